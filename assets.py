@@ -0,0 +1,199 @@
+import hashlib
+import json
+import time
+from pathlib import Path
+
+from PyQt5.QtCore import QSize, Qt
+from PyQt5.QtGui import QImage, QImageReader
+
+from config import atomic_write_text
+from perf import perf_log
+
+# Миниатюра вписывается в этот размер (превью печати и подписи в окне)
+THUMBNAIL_SIZE = QSize(150, 100)
+
+# Отличие от цвета фона (0–255 по самому отличающемуся каналу): ниже — фон,
+# выше BACKGROUND_SOFT — рисунок, между ними прозрачность нарастает плавно
+BACKGROUND_THRESHOLD = 24
+BACKGROUND_SOFT = 72
+# Поля вокруг рисунка, которые остаются после обрезки, в пикселях
+CROP_MARGIN = 2
+
+
+def prepare_element(source_path, target_path) -> bool:
+    """Делает фон скана прозрачным и обрезает пустые поля; результат — PNG.
+
+    Цвет фона — медиана рамки изображения в один пиксель. Если у файла уже
+    есть прозрачность, меняются только поля. Все операции выполняются
+    таблицами Pillow целиком над каналами, без циклов по пикселям.
+    Возвращает False, если рисунок не найден (тогда сохраняется исходное
+    изображение без изменений).
+    """
+    from PIL import Image, ImageChops, ImageStat
+
+    with Image.open(source_path) as source:
+        original = image = source.convert("RGBA")
+
+    alpha = image.getchannel("A")
+    if alpha.getextrema()[0] == 255:
+        rgb = image.convert("RGB")
+        width, height = rgb.size
+        border = Image.new("RGB", (2 * (width + height), 1))
+        border.paste(rgb.crop((0, 0, width, 1)), (0, 0))
+        border.paste(rgb.crop((0, height - 1, width, height)), (width, 0))
+        border.paste(rgb.crop((0, 0, 1, height)).transpose(Image.Transpose.ROTATE_90), (2 * width, 0))
+        border.paste(rgb.crop((width - 1, 0, width, height)).transpose(Image.Transpose.ROTATE_90), (2 * width + height, 0))
+        background = tuple(int(value) for value in ImageStat.Stat(border).median)
+
+        # Отличие от фона — максимум по каналам, затем таблица переводит его в прозрачность
+        red, green, blue = ImageChops.difference(rgb, Image.new("RGB", rgb.size, background)).split()
+        distance = ImageChops.lighter(ImageChops.lighter(red, green), blue)
+        ramp = BACKGROUND_SOFT - BACKGROUND_THRESHOLD
+        alpha = distance.point([
+            0 if value <= BACKGROUND_THRESHOLD else min(255, (value - BACKGROUND_THRESHOLD) * 255 // ramp)
+            for value in range(256)
+        ])
+        image = image.copy()
+        image.putalpha(alpha)
+
+    bbox = alpha.point([0] * 9 + [255] * 247).getbbox()  # Почти прозрачные пиксели полями считаем
+    if bbox is None:
+        # Весь рисунок совпал с фоном (например, сплошная заливка) — оставляем как есть
+        original.save(target_path, "PNG")
+        return False
+
+    left, top, right, bottom = bbox
+    image = image.crop((
+        max(0, left - CROP_MARGIN), max(0, top - CROP_MARGIN),
+        min(image.width, right + CROP_MARGIN), min(image.height, bottom + CROP_MARGIN)
+    ))
+    image.save(target_path, "PNG")
+    return True
+
+
+class AssetLibrary:
+    """Библиотека печатей и подписей с адресацией по содержимому.
+
+    Файл хранится как есть под именем <sha256><расширение>. Рядом лежат
+    подготовленная копия <sha256>_prepared.png (прозрачный фон, без пустых
+    полей) — ее и ставят на документы — и миниатюра <sha256>_thumb.png;
+    index.json хранит типы, имя и размеры подготовленной копии. Выбор другой
+    печати — поиск в индексе и чтение миниатюры, без декодирования
+    оригинала; повторный импорт того же файла ничего не пишет, а импорт
+    его как элемента другого типа только добавляет тип в индекс.
+    """
+
+    def __init__(self, cache_dir):
+        self.root = Path(cache_dir) / "assets"
+        self.index_file = self.root / "index.json"
+        self._index = None
+
+    @property
+    def index(self) -> dict:
+        if self._index is None:
+            self._index = self._load_index()
+        return self._index
+
+    def _load_index(self) -> dict:
+        if not self.index_file.exists():
+            return {}
+        try:
+            index = json.loads(self.index_file.read_text(encoding="utf-8"))
+        except ValueError:
+            return {}
+        for meta in index.values():
+            # Индекс прежних версий: один тип на файл
+            if "kind" in meta:
+                meta.setdefault("kinds", [meta.pop("kind")])
+        return index
+
+    def import_file(self, path, kind, name=None) -> str:
+        """Добавляет файл в библиотеку и возвращает его идентификатор (хэш)"""
+        path = Path(path)
+        data = path.read_bytes()
+        asset_id = hashlib.sha256(data).hexdigest()
+        if asset_id in self.index:
+            # Тот же файл можно использовать и как печать, и как подпись
+            kinds = self.index[asset_id]["kinds"]
+            if kind not in kinds:
+                kinds.append(kind)
+                self._save_index()
+            return asset_id
+
+        self.root.mkdir(parents=True, exist_ok=True)
+        suffix = path.suffix.lower() or ".png"
+        original_path = self.root / f"{asset_id}{suffix}"
+        original_path.write_bytes(data)
+
+        self.index[asset_id] = {
+            "kinds": [kind],
+            "name": name or path.stem,
+            "suffix": suffix,
+            "bytes": len(data),
+            "imported": round(time.time()),
+        }
+        try:
+            self.prepare(asset_id)
+        except (OSError, ValueError):
+            del self.index[asset_id]
+            original_path.unlink(missing_ok=True)
+            raise ValueError(f"Не удалось прочитать изображение: {path}")
+        return asset_id
+
+    def prepare(self, asset_id) -> None:
+        """Готовит копию для документов и миниатюру, если их еще нет.
+
+        Выполняется один раз на элемент (при импорте; для элементов, добавленных
+        прежними версиями, — при первом выборе) и сохраняется в библиотеке.
+        """
+        meta = self.index[asset_id]
+        if meta.get("prepared"):
+            return
+
+        with perf_log.stage("prepare_element", bytes=meta["bytes"]):
+            prepare_element(self.path(asset_id), self.prepared_path(asset_id))
+
+        # Миниатюру уменьшаем прямо при декодировании
+        reader = QImageReader(str(self.prepared_path(asset_id)))
+        size = reader.size()
+        fits = size.width() <= THUMBNAIL_SIZE.width() and size.height() <= THUMBNAIL_SIZE.height()
+        if not fits:
+            reader.setScaledSize(size.scaled(THUMBNAIL_SIZE, Qt.KeepAspectRatio))
+        thumbnail = reader.read()
+        if thumbnail.isNull():
+            raise ValueError(f"Не удалось прочитать изображение: {self.prepared_path(asset_id)}")
+        thumbnail.save(str(self.thumbnail_path(asset_id)))
+
+        meta.update(prepared=True, width=size.width(), height=size.height())
+        self._save_index()
+
+    def assets(self, kind) -> list:
+        """(идентификатор, метаданные) всех элементов данного типа по имени"""
+        items = [(asset_id, meta) for asset_id, meta in self.index.items() if kind in meta["kinds"]]
+        return sorted(items, key=lambda item: item[1]["name"].lower())
+
+    def path(self, asset_id) -> Path:
+        return self.root / f"{asset_id}{self.index[asset_id]['suffix']}"
+
+    def prepared_path(self, asset_id) -> Path:
+        return self.root / f"{asset_id}_prepared.png"
+
+    def thumbnail_path(self, asset_id) -> Path:
+        return self.root / f"{asset_id}_thumb.png"
+
+    def size(self, asset_id) -> QSize:
+        """Размер подготовленной копии из индекса (без декодирования)"""
+        meta = self.index[asset_id]
+        return QSize(meta["width"], meta["height"])
+
+    def image(self, asset_id) -> QImage:
+        """Подготовленная копия; оригинал — пока копия не создана"""
+        if self.index[asset_id].get("prepared"):
+            return QImage(str(self.prepared_path(asset_id)))
+        return QImage(str(self.path(asset_id)))
+
+    def thumbnail(self, asset_id) -> QImage:
+        return QImage(str(self.thumbnail_path(asset_id)))
+
+    def _save_index(self) -> None:
+        atomic_write_text(self.index_file, json.dumps(self.index, indent=4, ensure_ascii=False))
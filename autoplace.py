@@ -0,0 +1,192 @@
+import math
+import re
+from collections import Counter
+from itertools import accumulate
+
+from PyQt5.QtCore import Qt
+from PyQt5.QtGui import QImage
+
+from engine import Placement, px_per_mm
+from perf import perf_log
+
+# Страница анализируется клетками такого размера (A4 — около 105 × 149 клеток)
+CELL_MM = 2.0
+# Поля листа, на которые элементы не ставятся
+PAGE_MARGIN_MM = 10
+# Клетка считается занятой, если она темнее бумаги на столько уровней серого
+INK_CONTRAST = 12
+# Минимальная длина линии для подписи
+LINE_MIN_MM = 30
+# Какая доля высоты подписи опускается ниже линии
+SIGNATURE_LINE_OVERLAP = 0.3
+
+
+class InkMap:
+    """Занятые клетки страницы и их интегральное изображение.
+
+    Страница уменьшается до одной точки на клетку в оттенках серого;
+    клетка занята, если она заметно темнее бумаги. Сумма занятых клеток в
+    любом прямоугольнике считается за четыре обращения к таблице сумм.
+    """
+
+    def __init__(self, page_image, cell_mm=CELL_MM):
+        scale = px_per_mm(page_image)
+        self.width_mm = page_image.width() / scale
+        self.height_mm = page_image.height() / scale
+        self.cols = max(1, round(self.width_mm / cell_mm))
+        self.rows = max(1, round(self.height_mm / cell_mm))
+        self.cell_w = self.width_mm / self.cols
+        self.cell_h = self.height_mm / self.rows
+
+        gray = page_image.scaled(self.cols, self.rows, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+        gray = gray.convertToFormat(QImage.Format_Grayscale8)
+        bits = gray.constBits()
+        bits.setsize(gray.sizeInBytes())
+        data = bits.asstring()
+        stride = gray.bytesPerLine()
+        lines = [data[row * stride:row * stride + self.cols] for row in range(self.rows)]
+
+        # Цвет бумаги — яркость, светлее которой четверть клеток (сканы бывают сероватыми)
+        histogram = Counter(b"".join(lines))
+        paper, seen = 255, 0
+        while paper > 0 and seen + histogram[paper] < self.cols * self.rows / 4:
+            seen += histogram[paper]
+            paper -= 1
+        table = bytes(1 if value < paper - INK_CONTRAST else 0 for value in range(256))
+        self.ink = bytearray(b"".join(line.translate(table) for line in lines))
+
+        margin_x = math.ceil(PAGE_MARGIN_MM / self.cell_w)
+        margin_y = math.ceil(PAGE_MARGIN_MM / self.cell_h)
+        self.mark(0, 0, self.width_mm, margin_y * self.cell_h)
+        self.mark(0, self.height_mm - margin_y * self.cell_h, self.width_mm, margin_y * self.cell_h)
+        self.mark(0, 0, margin_x * self.cell_w, self.height_mm)
+        self.mark(self.width_mm - margin_x * self.cell_w, 0, margin_x * self.cell_w, self.height_mm)
+        self._sums = None
+
+    def mark(self, x_mm, y_mm, width_mm, height_mm):
+        """Помечает прямоугольник занятым (поля листа, уже поставленные элементы)"""
+        left = max(0, int(x_mm / self.cell_w))
+        top = max(0, int(y_mm / self.cell_h))
+        right = min(self.cols, math.ceil((x_mm + width_mm) / self.cell_w))
+        bottom = min(self.rows, math.ceil((y_mm + height_mm) / self.cell_h))
+        if right <= left:
+            return
+        for row in range(top, bottom):
+            self.ink[row * self.cols + left:row * self.cols + right] = b"\x01" * (right - left)
+        self._sums = None
+
+    def sums(self) -> list:
+        """Таблица сумм (rows + 1) × (cols + 1) с нулевыми первой строкой и столбцом"""
+        if self._sums is None:
+            stride = self.cols + 1
+            sums = [0] * stride
+            previous = sums
+            for row in range(self.rows):
+                line = [0]
+                line.extend(accumulate(self.ink[row * self.cols:(row + 1) * self.cols]))
+                line = [value + above for value, above in zip(line, previous)]
+                sums.extend(line)
+                previous = line
+            self._sums = sums
+        return self._sums
+
+    def lines(self, min_mm=LINE_MIN_MM) -> list:
+        """Горизонтальные линии для подписи: (ряд, первая клетка, клетка за последней).
+
+        Линия — полоса занятых клеток в один ряд высотой с пустыми рядами
+        над и под ней; строки текста выше одной клетки сюда не попадают.
+        """
+        pattern = re.compile(rb"\x01{%d,}" % math.ceil(min_mm / self.cell_w))
+        found = []
+        for row in range(1, self.rows - 1):
+            line = bytes(self.ink[row * self.cols:(row + 1) * self.cols])
+            above = self.ink[(row - 1) * self.cols:row * self.cols]
+            below = self.ink[(row + 1) * self.cols:(row + 2) * self.cols]
+            for match in pattern.finditer(line):
+                start, end = match.span()
+                if not any(above[start:end]) and not any(below[start:end]):
+                    found.append((row, start, end))
+        return found
+
+    def find_blank(self, width_mm, height_mm, anchor_mm, columns=None, rows=None):
+        """Свободное место ближе всего к точке anchor_mm; левый верхний угол в мм или None"""
+        width = math.ceil(width_mm / self.cell_w)
+        height = math.ceil(height_mm / self.cell_h)
+        sums = self.sums()
+        stride = self.cols + 1
+        anchor_x = anchor_mm[0] / self.cell_w - width / 2
+        anchor_y = anchor_mm[1] / self.cell_h - height / 2
+
+        best, best_distance = None, None
+        for y in rows if rows is not None else range(self.rows - height + 1):
+            if not 0 <= y <= self.rows - height:
+                continue
+            top, bottom = y * stride, (y + height) * stride
+            for x in columns if columns is not None else range(self.cols - width + 1):
+                if not 0 <= x <= self.cols - width:
+                    continue
+                if sums[bottom + x + width] - sums[top + x + width] - sums[bottom + x] + sums[top + x]:
+                    continue
+                distance = (x - anchor_x) ** 2 + (y - anchor_y) ** 2
+                if best_distance is None or distance < best_distance:
+                    best, best_distance = (x, y), distance
+        if best is None:
+            return None
+        return best[0] * self.cell_w, best[1] * self.cell_h
+
+
+def place_signature(ink_map, width_mm, height_mm):
+    # Сначала — на самую нижнюю линию, где над ней хватает места
+    above = math.ceil(height_mm * (1 - SIGNATURE_LINE_OVERLAP) / ink_map.cell_h)
+    for row, start, end in sorted(ink_map.lines(), reverse=True):
+        position = ink_map.find_blank(width_mm, above * ink_map.cell_h, (start * ink_map.cell_w, row * ink_map.cell_h),
+                                      columns=range(start, end), rows=[row - above])
+        if position is not None:
+            y_mm = (row + 0.5) * ink_map.cell_h - height_mm * (1 - SIGNATURE_LINE_OVERLAP)
+            return position[0], y_mm
+    # Линий нет — справа внизу
+    return ink_map.find_blank(width_mm, height_mm, (ink_map.width_mm * 0.7, ink_map.height_mm))
+
+
+def place_stamp(ink_map, width_mm, height_mm, signature_rect=None):
+    if signature_rect is not None:
+        # «М.П.» — обычно слева от подписи
+        x_mm, y_mm, signature_width, signature_height = signature_rect
+        anchor = (x_mm - width_mm / 2, y_mm + signature_height / 2)
+    else:
+        anchor = (ink_map.width_mm * 0.3, ink_map.height_mm)
+    return ink_map.find_blank(width_mm, height_mm, anchor)
+
+
+def auto_place(page_image, sizes_mm, page=0, occupied=()) -> list:
+    """Расставляет элементы по свободным местам страницы.
+
+    sizes_mm — {тип элемента: (ширина, высота)} в мм, occupied — уже
+    поставленные на страницу элементы как (тип, x, y, ширина, высота) в мм.
+    Элементы, которым не нашлось места, пропускаются. Для анализа хватает
+    превью страницы шириной в несколько сотен пикселей.
+    """
+    placements = []
+    with perf_log.stage("auto_place", width=page_image.width(), height=page_image.height()) as record:
+        ink_map = InkMap(page_image)
+        signature_rect = None
+        for element_type, *rect in occupied:
+            ink_map.mark(*rect)
+            if element_type == 'signature':
+                signature_rect = tuple(rect)
+
+        if 'signature' in sizes_mm:
+            width_mm, height_mm = sizes_mm['signature']
+            position = place_signature(ink_map, width_mm, height_mm)
+            if position is not None:
+                placements.append(Placement('signature', position[0], position[1], page))
+                signature_rect = (position[0], position[1], width_mm, height_mm)
+                ink_map.mark(*signature_rect)
+
+        if 'stamp' in sizes_mm:
+            width_mm, height_mm = sizes_mm['stamp']
+            position = place_stamp(ink_map, width_mm, height_mm, signature_rect)
+            if position is not None:
+                placements.append(Placement('stamp', position[0], position[1], page))
+        record["placed"] = len(placements)
+    return placements
@@ -0,0 +1,298 @@
+import glob
+import json
+import os
+import signal
+import sys
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import get_context
+from pathlib import Path
+
+from PyQt5.QtCore import QCoreApplication
+from PyQt5.QtGui import QImage
+
+import autoplace
+from assets import AssetLibrary
+from config import Config, DEFAULT_CACHE_DIR
+from documents import SUPPORTED_SUFFIXES, open_document, signed_suffix
+from encoding import SAVE_FORMATS, EncoderSettings
+from engine import Placement, SigningEngine, signed_output_path
+from manifest import MANIFEST_NAME, SigningManifest, SigningRequest
+from perf import perf_log
+from templates import TemplateStore
+
+SIGNED_MARKER = "_подписано"
+# Ширина превью, по которому ищутся свободные места (как у превью в окне)
+AUTO_PLACE_WIDTH = 600
+
+
+def collect_inputs(source) -> list:
+    """Файлы для подписания: содержимое каталога или результат glob-шаблона"""
+    source_path = Path(source)
+    if source_path.is_dir():
+        candidates = source_path.iterdir()
+    else:
+        candidates = (Path(p) for p in glob.glob(source, recursive=True))
+
+    return sorted(
+        path for path in candidates
+        if path.is_file()
+        and path.suffix.lower() in SUPPORTED_SUFFIXES
+        and not path.stem.endswith(SIGNED_MARKER)  # Не подписываем повторно уже подписанные копии
+    )
+
+
+def load_template(template, cache_dir=DEFAULT_CACHE_DIR) -> list:
+    """Шаблон размещения: имя сохраненного шаблона или JSON-файл со списком {"type", "page", "x_mm", "y_mm"}"""
+    template_path = Path(template)
+    if not template_path.is_file():
+        store = TemplateStore(cache_dir)
+        if template not in store.templates:
+            raise ValueError(f"Шаблон не найден: {template}")
+        return store.get(template)
+
+    data = json.loads(template_path.read_text(encoding="utf-8"))
+    if isinstance(data, dict):
+        data = data["placements"]
+    return [Placement.from_dict(item) for item in data]
+
+
+def load_engine(cache_dir) -> SigningEngine:
+    """Движок с печатью и подписью, выбранными в приложении"""
+    cache_dir = Path(cache_dir)
+    config = Config(str(cache_dir))
+    stamp = _load_element(cache_dir, config.settings['stamp_asset'], "stamp.png")
+    signature = _load_element(cache_dir, config.settings['signature_asset'], "signature.png")
+    return SigningEngine(
+        None if stamp.isNull() else stamp,
+        None if signature.isNull() else signature,
+        config.settings['stamp_size'],
+        config.settings['sign_size']
+    )
+
+
+def _load_element(cache_dir, asset_id, legacy_name) -> QImage:
+    library = AssetLibrary(cache_dir)
+    if asset_id and asset_id in library.index:
+        return library.image(asset_id)
+    # Кэш, сохраненный до появления библиотеки
+    return QImage(str(cache_dir / legacy_name))
+
+
+# Состояние процесса-исполнителя: движок и шаблон загружаются один раз на процесс
+_worker_app = None
+_worker_engine = None
+_worker_placements = None
+_worker_encoder = None
+_worker_auto_place = False
+_worker_manifest = None
+
+
+def _init_worker(cache_dir, placement_dicts, encoder_dict, auto_place=False):
+    global _worker_app, _worker_engine, _worker_placements, _worker_encoder, _worker_auto_place, _worker_manifest
+    _worker_app = QCoreApplication.instance() or QCoreApplication(sys.argv[:1])  # Нужен для загрузки плагинов форматов
+    _worker_engine = load_engine(cache_dir)
+    _worker_placements = [Placement.from_dict(item) for item in placement_dicts]
+    _worker_encoder = EncoderSettings.from_dict(encoder_dict)
+    _worker_auto_place = auto_place
+    _worker_manifest = SigningManifest(Path(cache_dir) / MANIFEST_NAME)
+    perf_log.log_path = Path(cache_dir) / "perf.jsonl"
+
+
+def _init_pool_worker(ignored_signals, *init_args):
+    # Сигналы группы процессов (Ctrl+C в терминале) обрабатывает родитель: он дожидается документов в работе
+    for signum in ignored_signals:
+        signal.signal(signum, signal.SIG_IGN)
+    _init_worker(*init_args)
+
+
+def _sign_one(path, save_path, recorded_path=None):
+    """Декодирование, сборка и кодирование одного документа внутри исполнителя: (успех, время, страниц).
+
+    Если журнал подписаний уже знает такой запрос, документ не собирается
+    заново (см. SigningManifest). recorded_path — окончательное имя копии,
+    когда save_path временный.
+    """
+    started = time.perf_counter()
+    pages = 0
+    try:
+        request = SigningRequest(path, _worker_engine, "auto" if _worker_auto_place else _worker_placements,
+                                 _worker_encoder)
+        ok = _worker_manifest.reuse(request, save_path, recorded_path) \
+            or _sign_document(request, path, save_path, recorded_path)
+        elapsed = time.perf_counter() - started
+        if ok:
+            pages = _page_count(path)
+    except Exception as e:
+        print(f"{path}: {e}", file=sys.stderr)
+        ok, elapsed = False, time.perf_counter() - started
+    return ok, elapsed, pages
+
+
+def _page_count(path) -> int:
+    # Только заголовок документа: страницы не декодируются
+    document = open_document(path)
+    try:
+        return document.page_count()
+    finally:
+        document.close()
+
+
+def auto_placements(engine, document) -> list:
+    """Элементы движка на свободных местах последней страницы документа"""
+    last = document.page_count() - 1
+    sizes = {
+        element_type: engine.element_size_mm(element_type)
+        for element_type, image in engine.images.items() if image is not None and not image.isNull()
+    }
+    # Свободные места ищутся по превью той же ширины, что и в окне. JPEG и PDF
+    # декодируются сразу уменьшенными; полная страница остальных форматов остается
+    # в памяти документа, и подписание рисует прямо в ней
+    return autoplace.auto_place(document.preview(last, AUTO_PLACE_WIDTH), sizes, last)
+
+
+def _sign_document(request, path, save_path, recorded_path=None) -> bool:
+    started = time.perf_counter()
+    document = open_document(path, exclusive=True)
+    try:
+        if _worker_auto_place:
+            placements = auto_placements(_worker_engine, document)
+        else:
+            placements = _worker_placements
+        ok = document.write_signed(_worker_engine, placements, save_path, _worker_encoder)
+    finally:
+        document.close()
+    if ok:
+        # Для автоматической расстановки в журнал попадает и итоговое размещение
+        _worker_manifest.record(request, save_path, time.perf_counter() - started,
+                                placements=placements if _worker_auto_place else None, recorded_path=recorded_path)
+    return ok
+
+
+def signed_jobs(files, output_dir, encoder) -> list:
+    """Пары (исходник, путь подписанной копии).
+
+    Смена формата может свести разные исходники к одному имени (a.png и a.bmp
+    -> a_подписано.jpg): у таких копий в имени остается расширение исходника.
+    Если имена совпадают и так, задание не запускается — иначе одна копия
+    молча заменила бы другую.
+    """
+    def save_path(path, keep_suffix=False):
+        return signed_output_path(path, output_dir, signed_suffix(path, encoder), keep_suffix)
+
+    targets = [save_path(path) for path in files]
+    counts = Counter(targets)
+    jobs = [(path, save_path(path, keep_suffix=True) if counts[target] > 1 else target)
+            for path, target in zip(files, targets)]
+
+    counts = Counter(target for _, target in jobs)
+    clashes = [str(path) for path, target in jobs if counts[target] > 1]
+    if clashes:
+        raise ValueError(f"Подписанные копии получают одинаковые имена: {', '.join(clashes)}")
+    return jobs
+
+
+def iter_signed(jobs, placements, cache_dir, encoder, workers=1, queue_size=None, auto_place=False):
+    """Выдает (путь, путь сохранения, успех, время, страниц) по мере готовности документов; jobs — из signed_jobs().
+
+    В пул передаются только пути: декодирование идет внутри исполнителей, а число
+    документов в работе ограничено workers + queue_size, поэтому декодированные
+    страницы не копятся в памяти.
+    """
+    init_args = (str(cache_dir), [placement.to_dict() for placement in placements], encoder.to_dict(), auto_place)
+
+    if workers <= 1:
+        _init_worker(*init_args)
+        for path, save_path in jobs:
+            yield (path, save_path) + _sign_one(str(path), str(save_path))
+        return
+
+    max_in_flight = workers + (workers if queue_size is None else queue_size)
+    # spawn, как и у службы: исполнители не наследуют состояние Qt и потоки родительского процесса
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn"), initializer=_init_pool_worker,
+                             initargs=((signal.SIGINT,),) + init_args) as pool:
+        pending = {}
+        for path, save_path in jobs:
+            if len(pending) >= max_in_flight:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield pending.pop(future) + future.result()
+            pending[pool.submit(_sign_one, str(path), str(save_path))] = (path, save_path)
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield pending.pop(future) + future.result()
+
+
+def run_batch(source, template, output_dir=None, cache_dir=DEFAULT_CACHE_DIR, workers=1, queue_size=None,
+              encoder=None, auto_place=False) -> int:
+    """Подписывает документы по шаблону или, при auto_place, по свободным местам последней страницы"""
+    files = collect_inputs(source)
+    if not files:
+        print(f"Нет документов для подписания: {source}")
+        return 1
+
+    encoder = encoder or EncoderSettings.from_settings(Config(str(cache_dir)).settings)
+    try:
+        placements = [] if auto_place else load_template(template, cache_dir)
+        jobs = signed_jobs(files, output_dir, encoder)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    if output_dir:
+        Path(output_dir).mkdir(parents=True, exist_ok=True)
+
+    failed = 0
+    signed_pages = 0
+    started = time.perf_counter()
+    for path, save_path, ok, elapsed, pages in iter_signed(jobs, placements, cache_dir, encoder, workers, queue_size, auto_place):
+        if ok:
+            signed_pages += pages
+            print(f"{path} -> {save_path} ({elapsed * 1000:.0f} мс)")
+        else:
+            failed += 1
+            print(f"{path}: ошибка подписания ({elapsed * 1000:.0f} мс)", file=sys.stderr)
+
+    total = time.perf_counter() - started
+    signed = len(files) - failed
+    print(f"Подписано {signed} из {len(files)} за {total:.2f} с ({signed / total:.2f} док/с, {signed_pages / total:.2f} стр/с)")
+    return 0 if failed == 0 else 1
+
+
+def add_arguments(parser):
+    parser.add_argument("source", help="Каталог с документами или glob-шаблон")
+    placement = parser.add_mutually_exclusive_group(required=True)
+    placement.add_argument("-t", "--template", help="Имя сохраненного шаблона размещения или JSON-файл")
+    placement.add_argument("--auto-place", action="store_true",
+                           help="Ставить печать и подпись на свободные места последней страницы")
+    parser.add_argument("-o", "--output-dir", help="Каталог для подписанных копий (по умолчанию рядом с исходником)")
+    parser.add_argument("--cache-dir", default=str(DEFAULT_CACHE_DIR), help="Каталог с библиотекой печатей, шаблонами и settings.json")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count() or 1, help="Число процессов-исполнителей")
+    parser.add_argument("--queue-size", type=int, help="Сколько документов может ждать свободного исполнителя (по умолчанию = --workers)")
+    add_encoder_arguments(parser)
+
+
+def add_encoder_arguments(parser):
+    # Параметры кодирования; по умолчанию берутся из settings.json
+    parser.add_argument("--format", choices=[''] + list(SAVE_FORMATS), help="Формат растровых копий ('' — как у исходника)")
+    parser.add_argument("--quality", type=int, help="Качество JPEG (0–100)")
+    parser.add_argument("--png-compression", type=int, choices=range(10), help="Уровень сжатия PNG (0 — быстро, 9 — компактно)")
+
+
+def encoder_from_args(args) -> EncoderSettings:
+    encoder = EncoderSettings.from_settings(Config(args.cache_dir).settings)
+    if args.format is not None:
+        encoder.format = args.format
+    if args.quality is not None:
+        encoder.quality = args.quality
+    if args.png_compression is not None:
+        encoder.png_compression = args.png_compression
+    return encoder
+
+
+def run_from_args(args) -> int:
+    encoder = encoder_from_args(args)
+    return run_batch(args.source, args.template, args.output_dir, args.cache_dir, args.workers, args.queue_size, encoder,
+                     args.auto_place)
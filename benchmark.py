@@ -0,0 +1,201 @@
+import argparse
+import json
+import math
+import os
+import platform
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+
+# Замеры идут без окна
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PyQt5.QtCore import Qt, QT_VERSION_STR, QRect
+from PyQt5.QtGui import QColor, QGuiApplication, QImage, QPainter
+
+from documents import RasterDocument
+from encoding import EncoderSettings, save_image
+from engine import A4_HEIGHT_MM, A4_WIDTH_MM, Placement, SigningEngine, calculate_element_size
+from perf import perf_log
+from view import DOCUMENT_PREVIEW_WIDTH
+
+DEFAULT_DPIS = (150, 300, 600)
+ORIENTATIONS = ("portrait", "landscape")
+STAMP_SIZE_MM = 42
+SIGN_SIZE_MM = 20
+# Размещение как у типового договора: печать и подпись внизу страницы
+PLACEMENTS = [Placement('stamp', 20, 150), Placement('signature', 80, 170)]
+
+
+def a4_size(dpi, orientation):
+    width = round(A4_WIDTH_MM / 25.4 * dpi)
+    height = round(A4_HEIGHT_MM / 25.4 * dpi)
+    return (height, width) if orientation == "landscape" else (width, height)
+
+
+def make_document(width, height) -> QImage:
+    """Синтетический скан: белый лист со «строками текста» и рамкой"""
+    image = QImage(width, height, QImage.Format_RGB32)
+    image.fill(Qt.white)
+    painter = QPainter(image)
+    margin = width // 12
+    line_height = max(height // 90, 2)
+    for index, y in enumerate(range(margin, height - margin, line_height * 2)):
+        # Строки разной длины, чтобы сжатие вело себя как на настоящем документе
+        line_width = (width - 2 * margin) * (60 + (index * 37) % 40) // 100
+        painter.fillRect(QRect(margin, y, line_width, line_height), QColor(40, 40, 40))
+    painter.setPen(QColor(0, 0, 0))
+    painter.drawRect(margin // 2, margin // 2, width - margin, height - margin)
+    painter.end()
+    return image
+
+
+def make_stamp(size=600) -> QImage:
+    image = QImage(size, size, QImage.Format_ARGB32)
+    image.fill(Qt.transparent)
+    painter = QPainter(image)
+    painter.setRenderHint(QPainter.Antialiasing)
+    painter.setPen(QColor(30, 60, 200))
+    for inset in (size // 40, size // 6):
+        painter.drawEllipse(inset, inset, size - 2 * inset, size - 2 * inset)
+    painter.end()
+    return image
+
+
+def make_signature(width=900, height=300) -> QImage:
+    image = QImage(width, height, QImage.Format_ARGB32)
+    image.fill(Qt.transparent)
+    painter = QPainter(image)
+    painter.setRenderHint(QPainter.Antialiasing)
+    painter.setPen(QColor(20, 20, 120))
+    for x in range(0, width - 30, 30):
+        painter.drawLine(x, height // 2 + (x % 90) - 45, x + 30, height // 2 - (x % 60) + 30)
+    painter.end()
+    return image
+
+
+def percentile(values, fraction):
+    """Процентиль по методу ближайшего ранга"""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def summarize(samples) -> dict:
+    mean = sum(samples) / len(samples)
+    return {
+        "runs": len(samples),
+        "mean_ms": round(mean * 1000, 3),
+        "p50_ms": round(percentile(samples, 0.50) * 1000, 3),
+        "p90_ms": round(percentile(samples, 0.90) * 1000, 3),
+        "p99_ms": round(percentile(samples, 0.99) * 1000, 3),
+        "throughput_per_s": round(1 / mean, 2) if mean else None,
+    }
+
+
+def measure(fn, iterations, prepare=None):
+    samples = []
+    for _ in range(iterations):
+        argument = prepare() if prepare else None
+        started = time.perf_counter()
+        fn(argument)
+        samples.append(time.perf_counter() - started)
+    return summarize(samples)
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдает килобайты, macOS — байты
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def run_case(dpi, orientation, iterations) -> dict:
+    """Один сценарий; запускается в отдельном процессе, чтобы пиковая память была своя"""
+    app = QGuiApplication.instance() or QGuiApplication(sys.argv[:1])
+    perf_log.enabled = False  # Журнал этапов не должен искажать замеры
+
+    width, height = a4_size(dpi, orientation)
+    with tempfile.TemporaryDirectory() as work_dir:
+        work_dir = Path(work_dir)
+        document_path = work_dir / "document.png"
+        make_document(width, height).save(str(document_path))
+        stamp, signature = make_stamp(), make_signature()
+        engine = SigningEngine(stamp, signature, STAMP_SIZE_MM, SIGN_SIZE_MM)
+        encoder = EncoderSettings()
+        document = QImage(str(document_path))
+
+        stages = {
+            "decode": measure(lambda _: QImage(str(document_path)), iterations),
+            "decode_preview": measure(
+                lambda _: RasterDocument(document_path).preview(0, DOCUMENT_PREVIEW_WIDTH), iterations),
+            "calculate_element_size": measure(
+                lambda _: [calculate_element_size(STAMP_SIZE_MM, stamp, document) for _ in range(1000)], iterations),
+            "compose_in_place": measure(
+                lambda image: engine.compose(image, PLACEMENTS, in_place=True), iterations,
+                prepare=lambda: document.copy()),
+            "compose_copy": measure(lambda _: engine.compose(document, PLACEMENTS), iterations),
+            "encode": measure(lambda _: save_image(document, work_dir / "encoded.png", encoder), iterations),
+            "sign_file": measure(
+                lambda _: engine.sign_file(document_path, work_dir / "signed.png", PLACEMENTS, encoder), iterations),
+        }
+        # calculate_element_size замеряется пачкой по 1000 вызовов
+        for key in ("mean_ms", "p50_ms", "p90_ms", "p99_ms"):
+            stages["calculate_element_size"][key] = round(stages["calculate_element_size"][key] / 1000, 6)
+        stages["calculate_element_size"]["throughput_per_s"] = round(
+            stages["calculate_element_size"]["throughput_per_s"] * 1000, 2)
+
+        return {
+            "case": f"a4-{dpi}dpi-{orientation}",
+            "dpi": dpi,
+            "orientation": orientation,
+            "width": width,
+            "height": height,
+            "decoded_bytes": document.sizeInBytes(),
+            "encoded_bytes": document_path.stat().st_size,
+            "stages": stages,
+            "peak_rss_mb": peak_rss_mb(),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Замеры конвейера подписания на синтетических документах")
+    parser.add_argument("-n", "--iterations", type=int, default=5, help="Повторов каждого этапа")
+    parser.add_argument("--dpi", type=int, nargs="+", default=list(DEFAULT_DPIS), help="Разрешения листа A4")
+    parser.add_argument("-o", "--output", help="Файл для результатов в JSON (по умолчанию stdout)")
+    args = parser.parse_args()
+
+    results = []
+    for dpi in args.dpi:
+        for orientation in ORIENTATIONS:
+            # Каждый сценарий в свежем процессе: пиковая память не наследуется от предыдущих
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+                result = pool.submit(run_case, dpi, orientation, args.iterations).result()
+            print(f"{result['case']}: sign_file p50 {result['stages']['sign_file']['p50_ms']} мс, "
+                  f"пик памяти {result['peak_rss_mb']} МБ", file=sys.stderr)
+            results.append(result)
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "qt": QT_VERSION_STR,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "iterations": args.iterations,
+        },
+        "results": results,
+    }
+    output = json.dumps(report, indent=4, ensure_ascii=False)
+    if args.output:
+        Path(args.output).write_text(output, encoding="utf-8")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,45 @@
-import os
+import argparse
 import shutil
+import statistics
+import subprocess
+import sys
+import time
 import PyInstaller.__main__
 from pathlib import Path
 
 # Конфигурационные параметры
 APP_NAME = "Singer"
+# Консольный вариант для batch и watch: у оконной сборки в Windows нет stdout и stderr,
+# и вывод подкоманд пропадает
+CONSOLE_APP_NAME = "Singer-cli"
 ENTRY_SCRIPT = "main.py"
 ICON_PATH = "icon.ico"  # Укажите путь к иконке или None
-ONE_FILE = True  # Собирать в один файл
+
+# Профили сборки:
+# onedir — каталог с программой; запускается быстро, т. к. ничего не распаковывается;
+# onefile — один файл; при каждом запуске распаковывает Qt во временный каталог
+PROFILES = {
+    "onedir": ["--onedir"],
+    "onefile": ["--onefile"],
+}
+DEFAULT_PROFILE = "onedir"
+
+# Модули, которые программе не нужны: без них меньше файлов в сборке и быстрее запуск.
+# Из Qt используются только QtCore, QtGui и QtWidgets
+EXCLUDED_MODULES = [
+    'PyQt5.QtBluetooth', 'PyQt5.QtDBus', 'PyQt5.QtDesigner', 'PyQt5.QtHelp', 'PyQt5.QtLocation',
+    'PyQt5.QtMultimedia', 'PyQt5.QtMultimediaWidgets', 'PyQt5.QtNetwork', 'PyQt5.QtNfc', 'PyQt5.QtOpenGL',
+    'PyQt5.QtPositioning', 'PyQt5.QtPrintSupport', 'PyQt5.QtQml', 'PyQt5.QtQuick', 'PyQt5.QtQuickWidgets',
+    'PyQt5.QtRemoteObjects', 'PyQt5.QtSensors', 'PyQt5.QtSerialPort', 'PyQt5.QtSql', 'PyQt5.QtSvg',
+    'PyQt5.QtTest', 'PyQt5.QtTextToSpeech', 'PyQt5.QtWebChannel', 'PyQt5.QtWebEngineCore',
+    'PyQt5.QtWebEngineWidgets', 'PyQt5.QtWebSockets', 'PyQt5.QtXml', 'PyQt5.QtXmlPatterns',
+    'tkinter', 'unittest',
+]
+
+# Сколько раз запускать собранную программу для замера времени запуска
+STARTUP_RUNS = 5
+STARTUP_TIMEOUT = 60
+
 
 def clean_dist_folder():
     """Очистка папок сборки"""
@@ -19,12 +51,13 @@ def clean_dist_folder():
         except Exception as e:
             print(f'Ошибка при очистке {folder}: {e}')
 
-def build():
+
+def build(profile=DEFAULT_PROFILE, console=False):
     """Запуск процесса сборки"""
     pyinstaller_args = [
         '--clean',
-        '--windowed',  # Без консоли
-        '--name', APP_NAME,
+        '--console' if console else '--windowed',  # Оконная сборка — без консоли
+        '--name', CONSOLE_APP_NAME if console else APP_NAME,
         '--noconfirm',
     ]
 
@@ -33,12 +66,14 @@ def build():
         pyinstaller_args.extend(['--icon', ICON_PATH])
 
     # Режим сборки
-    pyinstaller_args.append('--onefile' if ONE_FILE else '--onedir')
+    pyinstaller_args.extend(PROFILES[profile])
 
     # Обязательные скрытые импорты (только действительно необходимые)
     pyinstaller_args.extend([
         '--hidden-import', 'PyQt5.sip',  # Требуется для PyQt5
     ])
+    for module in EXCLUDED_MODULES:
+        pyinstaller_args.extend(['--exclude-module', module])
 
     # Добавляем точку входа
     pyinstaller_args.append(ENTRY_SCRIPT)
@@ -46,8 +81,61 @@ def build():
     # Запуск PyInstaller
     PyInstaller.__main__.run(pyinstaller_args)
 
+
+def executable_path(profile) -> Path:
+    name = APP_NAME + ('.exe' if sys.platform == 'win32' else '')
+    if profile == 'onedir':
+        return Path('dist') / APP_NAME / name
+    return Path('dist') / name
+
+
+def measure_startup(executable, runs=STARTUP_RUNS) -> list:
+    """Время от запуска программы до показа окна, с.
+
+    Программа с --startup-check закрывается на первом проходе цикла событий;
+    в замер входит и распаковка сборки onefile. Первый запуск (холодный
+    кэш диска) в статистику не идет.
+    """
+    times = []
+    for _ in range(runs + 1):
+        started = time.perf_counter()
+        subprocess.run([str(executable), '--startup-check'], check=True, timeout=STARTUP_TIMEOUT)
+        times.append(time.perf_counter() - started)
+    return times[1:]
+
+
+def startup_report(profile):
+    """Замеряет запуск собранной программы и сохраняет отчет рядом с ней"""
+    executable = executable_path(profile)
+    times = measure_startup(executable)
+    report = (
+        f"Профиль: {profile}\n"
+        f"Программа: {executable}\n"
+        f"Запусков: {len(times)}\n"
+        f"Время запуска: медиана {statistics.median(times) * 1000:.0f} мс, "
+        f"мин. {min(times) * 1000:.0f} мс, макс. {max(times) * 1000:.0f} мс\n"
+    )
+    Path('dist', 'startup_report.txt').write_text(report, encoding='utf-8')
+    print(report)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Сборка программы PyInstaller")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default=DEFAULT_PROFILE,
+                        help=f"Профиль сборки (по умолчанию {DEFAULT_PROFILE} — быстрый запуск)")
+    parser.add_argument("--no-report", action="store_true", help="Не замерять время запуска собранной программы")
+    parser.add_argument("--console", action="store_true",
+                        help=f"Собрать также консольный вариант {CONSOLE_APP_NAME} для batch и watch")
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
-    print("Начало сборки...")
+    args = parse_args()
+    print(f"Начало сборки ({args.profile})...")
     clean_dist_folder()
-    build()
-    print("\nСборка завершена! EXE-файл находится в папке 'dist'")
\ No newline at end of file
+    build(args.profile)
+    if args.console:
+        build(args.profile, console=True)
+    print("\nСборка завершена! Программа находится в папке 'dist'")
+    if not args.no_report:
+        startup_report(args.profile)
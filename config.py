@@ -1,26 +1,152 @@
+import atexit
 import json
+import os
+import tempfile
+import threading
 from pathlib import Path
 
+DEFAULT_CACHE_DIR = Path.home() / ".doc_signer_cache"
+
+DEFAULT_SETTINGS = {
+    "stamp_size": 42,
+    "sign_size": 20,
+    # Кодирование подписанного растра: формат ('' — как у исходника), качество JPEG, уровень zlib для PNG
+    "save_format": "",
+    "save_quality": 90,
+    "png_compression": 1,
+    # Шаблон размещения, который применяется к каждому новому документу
+    "template": "",
+    # Без шаблона искать для элементов свободное место на странице
+    "auto_place": False,
+    # Выбранные печать и подпись из библиотеки (хэши содержимого)
+    "stamp_asset": "",
+    "signature_asset": "",
+    # Дисковый кэш декодированных страниц, МБ (0 — выключен)
+    "frame_cache_mb": 1024,
+}
+
+
+# Изменения, сделанные за это время, записываются одним обращением к диску
+SAVE_DELAY_SECONDS = 0.5
+
 
 class Config:
-    def __init__(self, cache_dir):
+    """Настройки приложения в settings.json.
+
+    Файл читается один раз при первом обращении к settings. save_settings()
+    не пишет сразу, а откладывает запись на SAVE_DELAY_SECONDS: серия правок
+    (например, ввод числа по символу) превращается в одну запись. Запись
+    атомарная — через временный файл и переименование.
+    """
+
+    def __init__(self, cache_dir, save_delay=SAVE_DELAY_SECONDS):
         self.cache_dir = Path(cache_dir)
-        self.settings = self._load_settings()
+        self.save_delay = save_delay
+        self._settings = None
+        self._timer = None
+        self._dirty = False
+        self._flush_registered = False
+        self._lock = threading.Lock()
+
+    @property
+    def settings(self) -> dict:
+        if self._settings is None:
+            self._settings = self._load_settings()
+        return self._settings
 
     def _load_settings(self) -> dict:
         settings_file = self.cache_dir / "settings.json"
 
         if not settings_file.exists():
-            settings_file.parent.mkdir(exist_ok=True)
-            default = {"stamp_size": 42, "sign_size": 20}
-            settings_file.write_text(json.dumps(default, indent=4), encoding="utf-8")
+            default = dict(DEFAULT_SETTINGS)
+            self._save_raw(default)
             return default
 
-        return json.loads(settings_file.read_text(encoding="utf-8"))
+        try:
+            loaded = json.loads(settings_file.read_text(encoding="utf-8"))
+        except ValueError:
+            # Поврежденный файл (например, после сбоя старой версии при записи)
+            return dict(DEFAULT_SETTINGS)
+
+        # Ключи, появившиеся в новых версиях, берем из значений по умолчанию
+        return {**DEFAULT_SETTINGS, **loaded}
 
     def save_settings(self) -> None:  # Обновляем текущие настройки
-        self._save_raw(self.settings)
+        with self._lock:
+            self._dirty = True
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(self.save_delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+            if not self._flush_registered:
+                # Несохраненные изменения записываем и при выходе
+                atexit.register(self.flush)
+                self._flush_registered = True
+
+    def flush(self) -> None:
+        """Немедленно записывает отложенные изменения"""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._dirty:
+                return
+            self._dirty = False
+            # Копия словаря снимается под GIL целиком, поэтому правки из GUI-потока ей не мешают
+            data = dict(self.settings)
+            self._save_raw(data)
 
     def _save_raw(self, data: dict) -> None:
-        settings_file = self.cache_dir / "settings.json"
-        settings_file.write_text(json.dumps(data, indent=4), encoding="utf-8")
\ No newline at end of file
+        atomic_write_text(self.cache_dir / "settings.json", json.dumps(data, indent=4))
+
+
+def append_json_lines(path, records, sync=False) -> None:
+    """Дописывает записи в конец JSON-lines файла.
+
+    Все строки уходят одним вызовом write, поэтому строки разных процессов
+    (исполнители пакетного режима, служба) не перемешиваются. sync=True
+    дожидается, пока запись окажется на диске.
+    """
+    path = Path(path)
+    data = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records).encode("utf-8")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "ab", buffering=0) as jsonl_file:
+        jsonl_file.write(data)
+        if sync:
+            os.fsync(jsonl_file.fileno())
+
+
+def read_json_lines(path) -> list:
+    """Записи JSON-lines файла; строка, оборванная при аварийном завершении, пропускается"""
+    path = Path(path)
+    if not path.exists():
+        return []
+    records = []
+    with open(path, encoding="utf-8") as jsonl_file:
+        for line in jsonl_file:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    return records
+
+
+def atomic_write_text(path, text) -> None:
+    """Пишет во временный файл рядом и подменяет им целевой.
+
+    При сбое на диске остается либо старая, либо новая версия целиком.
+    """
+    path = Path(path)
+    path.parent.mkdir(exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(prefix=f".{path.stem}-", suffix=".tmp", dir=str(path.parent))
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as temp_file:
+            temp_file.write(text)
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        Path(temp_path).unlink(missing_ok=True)
+        raise
@@ -1,41 +1,73 @@
-from PyQt5.QtCore import Qt, QSize
-from PyQt5.QtGui import QPixmap, QPainter
-from PyQt5.QtWidgets import QFileDialog, QLabel
+from PyQt5.QtCore import Qt, QSize, QSizeF
+from PyQt5.QtGui import QImage, QKeySequence
+from PyQt5.QtWidgets import QFileDialog, QInputDialog, QMessageBox, QUndoStack
+
+from assets import AssetLibrary
+from autoplace import auto_place
+from config import Config, DEFAULT_CACHE_DIR
+from documents import FILE_DIALOG_FILTER, open_document, signed_suffix
+from encoding import EncoderSettings
+from engine import Placement, PlacementLayout, SigningEngine, calculate_element_size, element_size_mm, \
+    is_landscape, rotated_bounds_mm, signed_output_path
+from framecache import frame_cache
+from history import UNDO_LIMIT, AddPlacementCommand, MovePlacementCommand, RemovePlacementCommand, \
+    TransformPlacementCommand
+from manifest import MANIFEST_NAME, SigningManifest, sign_recorded
+from perf import perf_log
+from renditions import build_pyramid, renditions
+from tasks import run_in_background
+from templates import TemplateStore
+from view import DOCUMENT_PREVIEW_WIDTH, DocumentSigningView
 
-from config import Config
-from view import DocumentStamp, DocumentSigningView
-
-from pathlib import Path
 
 class DocumentSigningController:
     def __init__(self, view: DocumentSigningView):
         self.view = view
-        self.current_stamp = None
-        self.current_signature = None
+        # Выбранные печать и подпись — идентификаторы в библиотеке
+        self.stamp_asset = None
+        self.signature_asset = None
+        # Оригиналы декодируются только при добавлении на документ
+        self.element_images = {}
         self.current_document = None
         self.file_path = None
-        self.cache_dir = Path.home() / ".doc_signer_cache"
+        # Многостраничный документ: страницы декодируются по мере показа
+        self.document_source = None
+        self.current_page = 0
+        self.placement_layout = PlacementLayout()  # Элементы всех страниц в мм листа
+        # Правки размещения текущего документа, которые можно отменить
+        self.history = QUndoStack()
+        self.history.setUndoLimit(UNDO_LIMIT)
+        # Превью показывается сразу, а полная страница декодируется в фоне
+        self.document_ready = False
+        self.document_opening = False  # Документ открыт, но превью первой страницы еще не пришло
+        self.saving = False
+        self.cache_dir = DEFAULT_CACHE_DIR
         self.cache_dir.mkdir(exist_ok=True)
         self.config = Config(str(self.cache_dir))
+        self.templates = TemplateStore(self.cache_dir)
+        self.library = AssetLibrary(self.cache_dir)
+        # Повторно открытые документы читаются из кэша кадров без декодирования
+        frame_cache.configure(self.cache_dir / "frames", self.config.settings['frame_cache_mb'] * 1024 * 1024)
+        self.manifest = SigningManifest(self.cache_dir / MANIFEST_NAME)
         # Connect signals
         self.connect_signals()
-        self.stamps = []
-        self.signs = []
-
 
         # Загружаем сохраненные изображения (если есть)
         self.load_cached_images()
 
     def load_cached_images(self):
-        """Загружаем изображения из кэша при старте"""
-        stamp_path = self.cache_dir / "stamp.png"
-        signature_path = self.cache_dir / "signature.png"
-
-        if stamp_path.exists():
-            self.load_image(str(stamp_path), "stamp", save_to_cache=False)
-
-        if signature_path.exists():
-            self.load_image(str(signature_path), "signature", save_to_cache=False)
+        """Выбираем печать и подпись, сохраненные в настройках"""
+        for field_type in ('stamp', 'signature'):
+            asset_id = self.config.settings[f'{field_type}_asset']
+            legacy_path = self.cache_dir / f"{field_type}.png"
+            if not asset_id and not self.library.assets(field_type) and legacy_path.exists():
+                # Переносим в библиотеку файл, сохраненный прежними версиями
+                asset_id = self.library.import_file(legacy_path, field_type)
+
+            if asset_id in self.library.index:
+                self.select_asset(field_type, asset_id)
+            else:
+                self.refresh_assets(field_type)
 
     def connect_signals(self):
         # Connect clear buttons
@@ -43,6 +75,11 @@ class DocumentSigningController:
         self.view.signature_group.clear_button.clicked.connect(self.clear_signature)
         self.view.document_group.clear_button.clicked.connect(self.clear_document)
 
+        self.view.stamp_group.asset_combo.currentIndexChanged.connect(
+            lambda: self.select_asset('stamp', self.view.stamp_group.current_asset()))
+        self.view.signature_group.asset_combo.currentIndexChanged.connect(
+            lambda: self.select_asset('signature', self.view.signature_group.current_asset()))
+
         # # Connect add buttons
         self.connect_add_buttons()
 
@@ -58,18 +95,49 @@ class DocumentSigningController:
 
         self.view.sign_button.clicked.connect(self.handle_sign_document)
 
+        self.view.page_bar.prev_button.clicked.connect(lambda: self.show_page(self.current_page - 1))
+        self.view.page_bar.next_button.clicked.connect(lambda: self.show_page(self.current_page + 1))
+        self.view.document_view.element_moved.connect(self.placement_layout.move)
+        self.view.document_view.elements_dropped.connect(self.record_moves)
+        self.view.document_view.delete_requested.connect(self.delete_placements)
+        self.view.document_view.element_transformed.connect(self.on_element_transformed)
+        self.view.document_view.element_transform_finished.connect(self.record_transform)
+
+        undo_action = self.history.createUndoAction(self.view, "Отменить")
+        undo_action.setShortcut(QKeySequence.Undo)
+        redo_action = self.history.createRedoAction(self.view, "Повторить")
+        redo_action.setShortcut(QKeySequence.Redo)
+        self.view.set_history_actions(undo_action, redo_action)
+
         self.view.sign_size_input.set_text(str(self.config.settings['sign_size']))
         self.view.stamp_size_input.set_text(str(self.config.settings['stamp_size']))
 
         self.view.sign_size_input.input_widget.textChanged.connect(self.apply_sing_size_input)
         self.view.stamp_size_input.input_widget.textChanged.connect(self.apply_stamp_size_input)
 
+        self.view.save_format_input.set_value(self.config.settings['save_format'])
+        self.view.save_quality_input.set_text(str(self.config.settings['save_quality']))
+        self.view.png_compression_input.set_text(str(self.config.settings['png_compression']))
+
+        self.view.template_group.set_templates(self.templates.names(), self.config.settings['template'])
+        self.view.template_group.combo.currentIndexChanged.connect(self.select_template)
+        self.view.template_group.apply_button.clicked.connect(
+            lambda: self.apply_template(self.view.template_group.current_template()))
+        self.view.template_group.save_button.clicked.connect(self.save_template)
+        self.view.template_group.delete_button.clicked.connect(self.delete_template)
+        self.view.template_group.auto_place_check.setChecked(self.config.settings['auto_place'])
+        self.view.template_group.auto_place_check.toggled.connect(self.apply_auto_place_check)
+
+        self.view.save_format_input.combo.currentIndexChanged.connect(self.apply_save_format_input)
+        self.view.save_quality_input.input_widget.textChanged.connect(self.apply_save_quality_input)
+        self.view.png_compression_input.input_widget.textChanged.connect(self.apply_png_compression_input)
 
     def apply_sing_size_input(self, value: str):
         try:
             int_value = int(value)
             self.config.settings['sign_size'] = int_value
             self.config.save_settings()
+            self.refresh_elements('signature')
         except ValueError:
             self.view.sign_size_input.set_text(str(self.config.settings['sign_size']))
 
@@ -78,28 +146,111 @@ class DocumentSigningController:
             int_value = int(value)
             self.config.settings['stamp_size'] = int_value
             self.config.save_settings()
+            self.refresh_elements('stamp')
         except ValueError:
-            self.view.sign_size_input.set_text(str(self.config.settings['stamp_size']))
+            self.view.stamp_size_input.set_text(str(self.config.settings['stamp_size']))
 
-    def handle_sign_document(self):
-        if not self.current_document:
+    def apply_save_format_input(self, index: int):
+        self.config.settings['save_format'] = self.view.save_format_input.value()
+        self.config.save_settings()
+
+    def apply_save_quality_input(self, value: str):
+        try:
+            int_value = int(value)
+            if not 0 <= int_value <= 100:
+                raise ValueError
+            self.config.settings['save_quality'] = int_value
+            self.config.save_settings()
+        except ValueError:
+            self.view.save_quality_input.set_text(str(self.config.settings['save_quality']))
+
+    def apply_png_compression_input(self, value: str):
+        try:
+            int_value = int(value)
+            if not 0 <= int_value <= 9:
+                raise ValueError
+            self.config.settings['png_compression'] = int_value
+            self.config.save_settings()
+        except ValueError:
+            self.view.png_compression_input.set_text(str(self.config.settings['png_compression']))
+
+    def apply_auto_place_check(self, checked: bool):
+        self.config.settings['auto_place'] = checked
+        self.config.save_settings()
+
+    def select_template(self, index: int):
+        # Выбранный шаблон применяется ко всем следующим документам
+        self.config.settings['template'] = self.view.template_group.current_template()
+        self.config.save_settings()
+        self.view.template_group.update_buttons()
+
+    def apply_template(self, name):
+        """Заменяет текущее размещение элементами шаблона"""
+        if not name or self.current_document is None:
             return
 
-        final_pixmap = self.generate_final_document()
-        if not final_pixmap:
+        self.history.beginMacro(f"шаблон «{name}»")
+        for placement in self.placement_layout.placements():
+            self.history.push(RemovePlacementCommand(self, placement))
+        for placement in self.templates.get(name):
+            self.add_document_element(placement.element_type, placement)
+        self.history.endMacro()
+
+    def save_template(self):
+        if self.current_document is None:
+            return
+
+        name, ok = QInputDialog.getText(self.view, "Шаблон размещения", "Название шаблона:",
+                                        text=self.view.template_group.current_template())
+        name = name.strip()
+        if not ok or not name:
+            return
+
+        self.templates.save(name, self.all_placements())
+        self.view.template_group.set_templates(self.templates.names(), name)
+        self.select_template(self.view.template_group.combo.currentIndex())
+
+    def delete_template(self):
+        name = self.view.template_group.current_template()
+        if not name:
+            return
+
+        self.templates.delete(name)
+        self.view.template_group.set_templates(self.templates.names())
+        self.select_template(self.view.template_group.combo.currentIndex())
+
+    def handle_sign_document(self):
+        if self.current_document is None or not self.document_ready or self.saving:
             return
 
         # Сохраняем в файл (можно заменить на диалог выбора файла)
-        from pathlib import Path
+        encoder = EncoderSettings.from_settings(self.config.settings)
+        save_path = str(signed_output_path(self.file_path, suffix=signed_suffix(self.file_path, encoder)))
 
-        original_path = Path(self.file_path)
-        save_path = str(original_path.with_name(f"{original_path.stem}_подписано{original_path.suffix}"))
-        final_pixmap.save(save_path)
-        print(f"Документ сохранен как {save_path}")
+        # Кодирование больших страниц занимает секунды, поэтому идет в фоне
+        self.saving = True
+        self.view.set_saving(True)
+        self.update_sign_button_state()
+        run_in_background(
+            sign_recorded, self.manifest, self.document_source, self.create_engine(), self.all_placements(), save_path,
+            encoder,
+            on_finished=lambda ok: self.on_document_saved(save_path, ok),
+            on_failed=lambda error: self.on_document_saved(save_path, False, error)
+        )
+
+    def on_document_saved(self, save_path, ok, error=None):
+        self.saving = False
+        self.view.set_saving(False)
+        self.update_sign_button_state()
+
+        if not ok:
+            self.view.statusBar().clearMessage()
+            QMessageBox.warning(self.view, "Ошибка", f"Не удалось сохранить документ {save_path}: {error or ''}")
+            return
 
-        # Можно показать сообщение об успешном сохранении
-        from PyQt5.QtWidgets import QMessageBox
-        QMessageBox.information(self.view, "Готово", "Документ успешно подписан и сохранен!")
+        print(f"Документ сохранен как {save_path}")
+        # Сообщение об успешном сохранении не блокирует работу со следующим документом
+        self.view.statusBar().showMessage(f"Документ подписан и сохранен: {save_path}")
 
     def drag_enter_event(self, event):
         if event.mimeData().hasUrls():
@@ -116,78 +267,217 @@ class DocumentSigningController:
             self.view,
             f"Выберите {field_type}",
             "",
-            "Images (*.png *.jpg *.jpeg *.bmp)"
+            FILE_DIALOG_FILTER if field_type == 'document' else "Images (*.png *.jpg *.jpeg *.bmp)"
         )
         if file_path:
             self.load_image(file_path, field_type)
 
-    def load_image(self, file_path, field_type, save_to_cache=True):
-        pixmap = QPixmap(file_path)
-        if not pixmap.isNull():
-            if field_type == 'stamp':
-                self.clear_stamp()
-                self.current_stamp = pixmap
-                scaled_pixmap = pixmap.scaled(100, 100, Qt.KeepAspectRatio, Qt.SmoothTransformation)
-                self.view.stamp_group.set_content(scaled_pixmap)
-
-                # Сохраняем в кэш
-                if save_to_cache:
-                    cache_path = self.cache_dir / "stamp.png"
-                    pixmap.save(str(cache_path))
-
-            elif field_type == 'signature':
-                self.clear_signature()
-                self.current_signature = pixmap
-                scaled_pixmap = pixmap.scaled(150, 60, Qt.KeepAspectRatio, Qt.SmoothTransformation)
-                self.view.signature_group.set_content(scaled_pixmap)
-                # Сохраняем в кэш
-                if save_to_cache:
-                    cache_path = self.cache_dir / "signature.png"
-                    pixmap.save(str(cache_path))
-
-            elif field_type == 'document':
-                self.file_path = file_path
+    def load_image(self, file_path, field_type):
+        if field_type == 'document':
+            self.load_document(file_path)
+            return
+
+        # Повторный импорт того же файла находит его в библиотеке по хэшу
+        try:
+            asset_id = self.library.import_file(file_path, field_type)
+        except (OSError, ValueError):
+            return
+
+        self.select_asset(field_type, asset_id)
+
+    def refresh_assets(self, field_type):
+        group = self.view.stamp_group if field_type == 'stamp' else self.view.signature_group
+        items = [(asset_id, meta['name']) for asset_id, meta in self.library.assets(field_type)]
+        group.set_assets(items, self.element_asset(field_type))
+
+    def element_asset(self, element_type):
+        return self.stamp_asset if element_type == 'stamp' else self.signature_asset
+
+    def select_asset(self, field_type, asset_id):
+        """Выбор печати или подписи: показывается миниатюра, оригинал не декодируется"""
+        if asset_id is None:
+            self.clear_stamp() if field_type == 'stamp' else self.clear_signature()
+            return
+
+        try:
+            # Элементы, импортированные прежними версиями, готовятся при первом выборе
+            self.library.prepare(asset_id)
+        except (OSError, ValueError) as e:
+            print(f"Не удалось подготовить {field_type}: {e}")
+
+        thumbnail = self.library.thumbnail(asset_id)
+        if field_type == 'stamp':
+            self.stamp_asset = asset_id
+            group = self.view.stamp_group
+            scaled_image = thumbnail.scaled(100, 100, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+        else:
+            self.signature_asset = asset_id
+            group = self.view.signature_group
+            scaled_image = thumbnail.scaled(150, 60, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+        group.set_content(scaled_image)
+        self.refresh_assets(field_type)
+
+        # Держим декодированными только выбранные оригиналы
+        selected = (self.stamp_asset, self.signature_asset)
+        self.element_images = {key: image for key, image in self.element_images.items() if key in selected}
+
+        self.config.settings[f'{field_type}_asset'] = asset_id
+        self.config.save_settings()
+        self.update_sign_button_state()
+        self.refresh_elements(field_type)
+
+    def element_image(self, element_type):
+        asset_id = self.element_asset(element_type)
+        if asset_id is None:
+            return None
+        if asset_id not in self.element_images:
+            self.element_images[asset_id] = self.library.image(asset_id)
+        return self.element_images[asset_id]
+
+    def load_document(self, file_path):
+        if self.saving:
+            return  # Документ еще записывается в фоне
+
+        try:
+            source = open_document(file_path)
+        except RuntimeError as e:
+            QMessageBox.warning(self.view, "Ошибка", str(e))
+            return
+
+        if not source.page_count():
+            source.close()
+            return
+
+        self.clear_document()
+        self.file_path = file_path
+        self.document_source = source
+        self.document_opening = True
+        self.view.document_group.set_content(text="Загрузка...")
+        self.show_page(0)
+
+    def show_page(self, index):
+        """Показывает превью страницы с ее элементами из общей модели размещения.
+
+        Превью декодируется в фоне (страница TIFF или PNG на 600 dpi — это
+        сотни миллисекунд); до его появления в окне остается прежняя страница,
+        а элементы на новую не добавляются.
+        """
+        if self.document_source is None or not 0 <= index < self.document_source.page_count():
+            return
+
+        self.current_page = index
+        self.current_document = None
+        self.document_ready = False
+        self.view.page_bar.set_page(index, self.document_source.page_count())
+        self.update_sign_button_state()
+
+        source = self.document_source
+        run_in_background(
+            source.preview, index, DOCUMENT_PREVIEW_WIDTH,
+            on_finished=lambda preview: self.on_preview_loaded(source, index, preview),
+            on_failed=lambda error: self.on_preview_loaded(source, index, QImage(), error)
+        )
+
+    def on_preview_loaded(self, source, index, preview, error=None):
+        # Пока шло декодирование, документ или страница могли смениться
+        if source is not self.document_source or index != self.current_page:
+            return
+        if preview.isNull():
+            print(f"Не удалось декодировать страницу {index + 1}: {error or ''}")
+            if self.document_opening:
                 self.clear_document()
-                self.current_document = pixmap
-                scaled_pixmap = pixmap.scaled(200, 200, Qt.KeepAspectRatio, Qt.SmoothTransformation)
-                self.view.document_group.set_content(scaled_pixmap)
-                self.view.set_document_edit_image(pixmap)
+                QMessageBox.warning(self.view, "Ошибка", f"Не удалось открыть документ {self.file_path}")
+            return
+
+        self.current_document = preview
+        self.view.set_document_edit_image(self.current_document)
+        for placement in self.placement_layout.page(index):
+            self.show_element(placement)
+
+        # Полная страница нужна для подписания: декодируем ее в фоне
+        # (если превью получено из нее же, она уже в памяти документа)
+        run_in_background(
+            source.page, index,
+            on_finished=lambda image: self.on_page_decoded(source, index, image),
+            on_failed=lambda error: print(f"Не удалось декодировать страницу {index + 1}: {error}")
+        )
+        self.update_sign_button_state()
+
+        if self.document_opening:
+            self.document_opening = False
+            scaled_image = preview.scaled(200, 200, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+            self.view.document_group.set_content(scaled_image)
+
+            # Сразу расставляем элементы по выбранному шаблону или по свободным местам
+            if self.config.settings['template']:
+                self.apply_template(self.config.settings['template'])
+            elif self.config.settings['auto_place']:
+                self.auto_place_elements(['signature', 'stamp'])
+
+    def on_page_decoded(self, source, index, image):
+        # Пока шло декодирование, документ или страница могли смениться
+        if source is not self.document_source or index != self.current_page or image.isNull():
+            return
+        self.document_ready = True
+        self.update_sign_button_state()
 
+        # Уровни для увеличения строим из уже декодированной страницы
+        run_in_background(
+            build_pyramid, image, DOCUMENT_PREVIEW_WIDTH,
+            on_finished=lambda levels: self.on_pyramid_built(source, index, levels),
+            on_failed=lambda error: print(f"Не удалось подготовить увеличение страницы {index + 1}: {error}")
+        )
 
-            self.update_sign_button_state()
+    def on_pyramid_built(self, source, index, levels):
+        if source is not self.document_source or index != self.current_page:
+            return
+        self.view.document_view.set_levels(levels)
 
     def clear_stamp(self):
-        self.current_stamp = None
+        self.stamp_asset = None
         self.view.stamp_group.clear()
+        self.refresh_assets('stamp')
+        self.config.settings['stamp_asset'] = ""
+        self.config.save_settings()
         self.update_sign_button_state()
 
     def clear_signature(self):
-        self.current_signature = None
+        self.signature_asset = None
         self.view.signature_group.clear()
+        self.refresh_assets('signature')
+        self.config.settings['signature_asset'] = ""
+        self.config.save_settings()
         self.update_sign_button_state()
 
     def clear_document(self):
-        self.stamps.clear()
-        self.signs.clear()
+        # Команды ссылаются на элементы прежнего документа
+        self.history.clear()
         self.current_document = None
+        self.document_ready = False
+        self.document_opening = False
+        self.placement_layout.clear()
+        self.current_page = 0
+        if self.document_source is not None:
+            self.document_source.close()
+            self.document_source = None
         self.view.document_group.clear()
-
-        for child in self.view.document_edit_area.children():
-            if isinstance(child, QLabel):
-                child.deleteLater()
+        self.view.page_bar.set_page(0, 0)
+        self.view.document_view.clear()
 
         self.update_sign_button_state()
 
     def update_sign_button_state(self):
         all_filled = all([
-            self.current_stamp is not None,
-            self.current_signature is not None,
-            self.current_document is not None
+            self.stamp_asset is not None,
+            self.signature_asset is not None,
+            self.current_document is not None,
+            self.document_ready,
+            not self.saving
         ])
         self.view.sign_button.setEnabled(all_filled)
 
-        self.view.signature_group.enable_add(self.current_document is not None and self.current_signature  is not None)
-        self.view.stamp_group.enable_add(self.current_document is not None and self.current_stamp  is not None)
+        self.view.signature_group.enable_add(self.current_document is not None and self.signature_asset is not None)
+        self.view.stamp_group.enable_add(self.current_document is not None and self.stamp_asset is not None)
 
     def connect_add_buttons(self):
         if self.view.stamp_group.add_button:
@@ -198,197 +488,162 @@ class DocumentSigningController:
                 lambda: self.add_document_element('signature'))
 
     def is_document_landscape(self, pixmap):
-        return pixmap.width() > pixmap.height()
+        return is_landscape(pixmap)
 
-    def calculate_element_size(self, element_type, document_pixmap):
-        # Физические размеры A4 в мм
-        a4_width_mm = 210
-        a4_height_mm = 297
+    def element_width_mm(self, element_type):
+        if element_type == 'stamp':
+            return self.config.settings['stamp_size']
+        if element_type == 'signature':
+            return self.config.settings['sign_size']
+        return 0
 
-        # Определяем ориентацию документа
-        is_landscape = self.is_document_landscape(document_pixmap)
+    def element_size_mm(self, element_type, scale=1.0):
+        # Размер оригинала берется из индекса библиотеки, без декодирования
+        element_size = self.library.size(self.element_asset(element_type))
+        return element_size_mm(self.element_width_mm(element_type) * scale, element_size)
 
+    def placement_size_mm(self, placement):
+        return self.element_size_mm(placement.element_type, placement.scale)
 
-        # Размеры элементов в мм
-        if element_type == 'stamp':
-            element_width_mm = self.config.settings['stamp_size']
-            element_pixmap = self.current_stamp
-        elif element_type == 'signature':
-            element_width_mm = self.config.settings['sign_size']
-            element_pixmap = self.current_signature
-        else:
+    def calculate_element_size(self, element_type, document_image, scale=1.0):
+        if element_type not in ('stamp', 'signature'):
             return QSize(0, 0)
 
-        # Рассчитываем соотношение пикселей к миллиметрам
-        if is_landscape:
-            px_per_mm = document_pixmap.width() / a4_height_mm
-        else:
-            px_per_mm = document_pixmap.width() / a4_width_mm
-
-        # Вычисляем размеры в пикселях
-        width_px = int(element_width_mm * px_per_mm)
-        height_px = int(width_px * (element_pixmap.height() / element_pixmap.width())) # Сохраняем пропорции A4
+        element_size = self.library.size(self.element_asset(element_type))
+        return calculate_element_size(self.element_width_mm(element_type) * scale, element_size, document_image)
 
-        return QSize(width_px, height_px)
-
-    def add_document_element(self, element_type):
-        if not self.current_document:
+    def add_document_element(self, element_type, placement=None):
+        if self.current_document is None:
             return
 
-        if element_type == 'stamp' and not self.current_stamp:
+        if self.element_asset(element_type) is None:
             return
-        elif element_type == 'signature' and not self.current_signature:
+
+        if placement is None and self.config.settings['auto_place']:
+            self.auto_place_elements([element_type])
             return
 
-        # Получаем нужное изображение
-        pixmap = self.current_stamp if element_type == 'stamp' else self.current_signature
+        if placement is None:
+            placement = self.centered_placement(element_type)
 
-        # Рассчитываем размер
-        element_size = self.calculate_element_size(element_type, self.view.doc_label.pixmap())
+        self.history.push(AddPlacementCommand(self, placement))
 
-        # Создаем элемент
-        element = DocumentStamp(self.view.document_edit_area)
-        if element_type == 'stamp':
-            self.stamps.append(element)
-        else: self.signs.append(element)
-
-        scaled_pixmap = pixmap.scaled(
-            element_size.width(),
-            element_size.height(),
-            Qt.KeepAspectRatio,
-            Qt.SmoothTransformation
-        )
-        element.setPixmap(scaled_pixmap)
-        element.setFixedSize(element_size)
-
-        # Позиционирование (центрирование по умолчанию)
-        doc_rect = self.view.document_edit_area.rect()
-        x = (doc_rect.width() - element_size.width()) // 2
-        y = (doc_rect.height() - element_size.height()) // 2
-        element.move(x, y)
-        element.show()
-
-    # def generate_final_document(self):
-    #     if not self.current_document:
-    #         return None
-    #
-    #     # Создаем QPixmap с размером оригинального документа
-    #     final_pixmap = QPixmap(self.current_document.size())
-    #     final_pixmap.fill(Qt.white)  # Белый фон
-    #
-    #     # Рисуем на нем оригинальный документ
-    #     painter = QPainter(final_pixmap)
-    #     painter.drawPixmap(0, 0, self.current_document)
-    #
-    #     # Рассчитываем масштаб между отображаемым и оригинальным документом
-    #     scale_x = self.current_document.width() / self.view.doc_label.width()
-    #     scale_y = self.current_document.height() / self.view.doc_label.height()
-    #
-    #     # Рисуем все элементы (печати и подписи)
-    #     for element in self.elements:
-    #         if not element.pixmap():
-    #             continue
-    #
-    #         # Получаем позицию элемента относительно doc_label
-    #         element_pos = element.pos()
-    #         label_pos = self.view.doc_label.pos()
-    #         relative_x = element_pos.x() - label_pos.x()
-    #         relative_y = element_pos.y() - label_pos.y()
-    #
-    #         # Масштабируем позицию и размер
-    #         original_x = int(relative_x * scale_x)
-    #         original_y = int(relative_y * scale_y)
-    #         original_width = int(element.width() * scale_x)
-    #         original_height = int(element.height() * scale_y)
-    #
-    #         # Масштабируем изображение элемента
-    #         scaled_element = element.pixmap().scaled(
-    #             original_width,
-    #             original_height,
-    #             Qt.KeepAspectRatio,
-    #             Qt.SmoothTransformation
-    #         )
-    #
-    #         # Рисуем элемент на итоговом изображении
-    #         painter.drawPixmap(original_x, original_y, scaled_element)
-    #
-    #     painter.end()
-    #     return final_pixmap
-
-    def generate_final_document(self):
-        if not self.current_document:
-            return None
+    def auto_place_elements(self, element_types):
+        """Ставит элементы на свободные места текущей страницы (по превью).
+
+        Если места не нашлось, элемент встает в центр, как без автоматического режима.
+        """
+        element_types = [element_type for element_type in element_types if self.element_asset(element_type) is not None]
+        if not element_types or self.current_document is None:
+            return
 
-        # Создаем QPixmap с размером оригинального документа
-        final_pixmap = QPixmap(self.current_document.size())
-        final_pixmap.fill(Qt.white)  # Белый фон
-
-        # Рисуем на нем оригинальный документ
-        painter = QPainter(final_pixmap)
-        painter.drawPixmap(0, 0, self.current_document)
-
-        # Рассчитываем масштаб между отображаемым и оригинальным документом
-        scale_x = self.current_document.width() / self.view.doc_label.width()
-        scale_y = self.current_document.height() / self.view.doc_label.height()
-
-        # Рисуем все штампы
-
-        for stamp in self.stamps:
-            original_pixmap = self.current_stamp
-            if not original_pixmap:
-                continue
-
-            # Получаем позицию элемента относительно doc_label
-            element_pos = stamp.pos()
-            label_pos = self.view.doc_label.pos()
-            relative_x = element_pos.x() - label_pos.x()
-            relative_y = element_pos.y() - label_pos.y()
-
-            # Масштабируем позицию и размер
-            original_x = int(relative_x * scale_x)
-            original_y = int(relative_y * scale_y)
-            original_width = int(stamp.width() * scale_x)
-            original_height = int(stamp.height() * scale_y)
-
-            # Масштабируем оригинальное изображение (не преобразованное)
-            scaled_element = original_pixmap.scaled(
-                original_width,
-                original_height,
-                Qt.KeepAspectRatio,
-                Qt.SmoothTransformation
-            )
-
-            # Рисуем элемент на итоговом изображении
-            painter.drawPixmap(original_x, original_y, scaled_element)
-
-        # Рисуем все подписи
-        for sign in self.signs:
-            original_pixmap = self.current_signature
-            if not original_pixmap:
-                continue
-
-            # Получаем позицию элемента относительно doc_label
-            element_pos = sign.pos()
-            label_pos = self.view.doc_label.pos()
-            relative_x = element_pos.x() - label_pos.x()
-            relative_y = element_pos.y() - label_pos.y()
-
-            # Масштабируем позицию и размер
-            original_x = int(relative_x * scale_x)
-            original_y = int(relative_y * scale_y)
-            original_width = int(sign.width() * scale_x)
-            original_height = int(sign.height() * scale_y)
-
-            # Масштабируем оригинальное изображение (не преобразованное)
-            scaled_element = original_pixmap.scaled(
-                original_width,
-                original_height,
-                Qt.KeepAspectRatio,
-                Qt.SmoothTransformation
-            )
-
-            # Рисуем элемент на итоговом изображении
-            painter.drawPixmap(original_x, original_y, scaled_element)
-
-        painter.end()
-        return final_pixmap
\ No newline at end of file
+        occupied = [
+            (placement.element_type, *rotated_bounds_mm(placement.x_mm, placement.y_mm,
+                                                        *self.placement_size_mm(placement), placement.rotation))
+            for placement in self.placement_layout.page(self.current_page)
+        ]
+        sizes = {element_type: self.element_size_mm(element_type) for element_type in element_types}
+        placements = {
+            placement.element_type: placement
+            for placement in auto_place(self.current_document, sizes, self.current_page, occupied)
+        }
+        self.history.beginMacro("расстановка элементов")
+        for element_type in element_types:
+            self.add_document_element(element_type, placements.get(element_type) or self.centered_placement(element_type))
+        self.history.endMacro()
+
+    def centered_placement(self, element_type):
+        """Элемент в центре видимой части страницы"""
+        width_mm, height_mm = self.element_size_mm(element_type)
+        center = self.view.document_view.visible_center()
+        return Placement(element_type, center.x() - width_mm / 2, center.y() - height_mm / 2, self.current_page)
+
+    def insert_placement(self, placement):
+        """Добавляет элемент в модель и, если он на текущей странице, в сцену"""
+        self.placement_layout.add(placement)
+        # Пока превью страницы грузится, элемент появится вместе с ним
+        if placement.page == self.current_page and self.current_document is not None:
+            self.show_element(placement)
+
+    def take_placement(self, placement):
+        self.placement_layout.remove(placement)
+        self.view.document_view.remove_element(placement)
+
+    def set_placement_geometry(self, placement, x_mm, y_mm, scale, rotation):
+        """Положение, размер и поворот; копия для превью пересчитывается под новый размер"""
+        self.placement_layout.transform(placement, x_mm, y_mm, scale, rotation)
+        if self.view.document_view.element_item(placement) is not None:
+            self.view.document_view.transform_element(placement, self.element_rendition(placement))
+
+    def on_element_transformed(self, placement, x_mm, y_mm, scale, rotation):
+        # Пока тянут ручку, растягиваем прежнюю копию: новая строится после отпускания
+        self.placement_layout.transform(placement, x_mm, y_mm, scale, rotation)
+        self.view.document_view.transform_element(placement)
+
+    def record_transform(self, placement, old_geometry):
+        new_geometry = (placement.x_mm, placement.y_mm, placement.scale, placement.rotation)
+        self.history.push(TransformPlacementCommand(self, placement, old_geometry, new_geometry))
+
+    def set_placement_position(self, placement, x_mm, y_mm):
+        self.placement_layout.move(placement, x_mm, y_mm)
+        item = self.view.document_view.element_item(placement)
+        if item is not None:
+            item.setPos(x_mm, y_mm)
+
+    def reveal_placement(self, placement):
+        """При отмене и повторе переходим на страницу, где меняется элемент"""
+        if placement.page != self.current_page:
+            self.show_page(placement.page)
+
+    def record_moves(self, moves):
+        # Элементы уже на новых местах; в историю пишется только сдвиг
+        self.history.beginMacro("перемещение элементов")
+        for placement, old_position in moves:
+            self.history.push(MovePlacementCommand(self, placement, old_position, (placement.x_mm, placement.y_mm)))
+        self.history.endMacro()
+
+    def delete_placements(self, placements):
+        self.history.beginMacro("удаление элементов")
+        for placement in placements:
+            self.history.push(RemovePlacementCommand(self, placement))
+        self.history.endMacro()
+
+    def show_element(self, placement):
+        """Добавляет элемент модели в сцену текущей страницы"""
+        base_size_mm = QSizeF(*self.element_size_mm(placement.element_type))
+        self.view.document_view.add_element(placement, self.element_rendition(placement), base_size_mm)
+
+    def refresh_elements(self, element_type):
+        """Перерисовывает элементы текущей страницы после смены размера или самого элемента.
+
+        Подписание берет размер из настроек, поэтому и в сцене элемент
+        должен быть того же размера.
+        """
+        if self.current_document is None or self.element_asset(element_type) is None:
+            return
+        base_size_mm = QSizeF(*self.element_size_mm(element_type))
+        for placement in self.placement_layout.page(self.current_page):
+            if placement.element_type == element_type and self.view.document_view.element_item(placement) is not None:
+                self.view.document_view.transform_element(placement, self.element_rendition(placement), base_size_mm)
+
+    def element_rendition(self, placement):
+        """Копия элемента для превью — в пикселях страницы превью, с учетом размера элемента"""
+        element_type = placement.element_type
+        image = self.element_image(element_type)
+        element_size = self.calculate_element_size(element_type, self.view.document_view.page_item.pixmap(),
+                                                   placement.scale)
+        with perf_log.stage("element_scale", element=element_type, width=element_size.width(),
+                            height=element_size.height()):
+            return renditions.scaled(image, element_size)
+
+    def all_placements(self):
+        # Копии: подписание идет в фоне, а элементы тем временем можно двигать
+        return [placement.copy() for placement in self.placement_layout.placements()]
+
+    def create_engine(self):
+        return SigningEngine(
+            self.element_image('stamp'),
+            self.element_image('signature'),
+            self.config.settings['stamp_size'],
+            self.config.settings['sign_size']
+        )
@@ -0,0 +1,420 @@
+import io
+import shutil
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from PyQt5.QtCore import QBuffer, QByteArray, QIODevice, QSize, Qt
+from PyQt5.QtGui import QImage, QImageReader
+
+from encoding import save_image
+from engine import A4_HEIGHT_MM, A4_WIDTH_MM, rotated_bounds_mm
+from framecache import frame_cache, source_key
+from perf import file_info, image_info, perf_log
+from renditions import renditions
+from tiffpages import TiffPageWriter, TiffPages
+
+RASTER_SUFFIXES = {'.png', '.jpg', '.jpeg', '.bmp'}
+TIFF_SUFFIXES = {'.tif', '.tiff'}
+PDF_SUFFIXES = {'.pdf'}
+SUPPORTED_SUFFIXES = RASTER_SUFFIXES | TIFF_SUFFIXES | PDF_SUFFIXES
+
+FILE_DIALOG_FILTER = "Документы (*.png *.jpg *.jpeg *.bmp *.tif *.tiff *.pdf)"
+
+# Разрешение, с которым страницы PDF растеризуются для показа
+PDF_RENDER_DPI = 150
+# Разрешение, с которым печать и подпись встраиваются в PDF
+PDF_STAMP_DPI = 300
+
+
+def load_fitz():
+    """PyMuPDF нужен только для PDF; его импорт — заметная часть запуска, поэтому он откладывается"""
+    try:
+        import fitz
+    except ImportError:
+        raise RuntimeError("Для работы с PDF установите пакет PyMuPDF")
+    return fitz
+
+
+def open_document(path, exclusive=False):
+    """Открывает документ без декодирования страниц.
+
+    exclusive — страницы документа нигде не показываются (пакетный режим):
+    подписание рисует прямо в странице из памяти, без копии.
+    """
+    suffix = Path(path).suffix.lower()
+    if suffix in TIFF_SUFFIXES:
+        document = TiffDocument(path)
+    elif suffix in PDF_SUFFIXES:
+        document = PdfDocument(path)
+    else:
+        document = RasterDocument(path)
+    document.exclusive = exclusive
+    return document
+
+
+def signed_suffix(path, encoder=None) -> str:
+    """Расширение подписанной копии: формат меняется только у одностраничных растров"""
+    suffix = Path(path).suffix
+    if encoder is not None and suffix.lower() in RASTER_SUFFIXES:
+        return encoder.suffix(suffix)
+    return suffix
+
+
+def placements_by_page(placements, page_count) -> dict:
+    pages = {}
+    for placement in placements:
+        if 0 <= placement.page < page_count:
+            pages.setdefault(placement.page, []).append(placement)
+    return pages
+
+
+class DocumentSource:
+    """Многостраничный документ с ленивым декодированием страниц.
+
+    Страница декодируется только при показе или когда на нее ставится
+    элемент; несколько последних страниц держатся в памяти, а декодированные
+    кадры — в дисковом кэше frame_cache (повторное открытие того же файла
+    обходится без декодирования). Методы можно вызывать из рабочих потоков.
+    Блокировка документа защищает только страницы в памяти: декодирование
+    идет без нее, поэтому закрытие документа из окна не ждет, пока
+    декодируется большая страница.
+    """
+
+    max_cached_pages = 3
+    reduced_preview = False  # Умеет ли формат декодировать страницу сразу уменьшенной
+    exclusive = False  # Страницы из памяти никто, кроме подписания, не держит
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._pages = OrderedDict()
+        self._lock = threading.RLock()
+
+    def page_count(self) -> int:
+        raise NotImplementedError
+
+    def page(self, index) -> QImage:
+        with self._lock:
+            image = self._pages.get(index)
+            if image is not None:
+                self._pages.move_to_end(index)
+                return image
+
+        image = self._load_page(index)
+        if image.isNull():
+            return image
+        with self._lock:
+            self._pages[index] = image
+            self._pages.move_to_end(index)
+            if len(self._pages) > self.max_cached_pages:
+                self._pages.popitem(last=False)
+        return image
+
+    def _page_for_signing(self, index) -> QImage:
+        """Страница, на которой можно рисовать элементы.
+
+        Страница из памяти общая с показом (и с пирамидой окна), поэтому
+        подписывается ее копия. Иначе страница загружается заново и в
+        памяти не остается. У exclusive-документа страница забирается из
+        памяти: пакетный режим рисует прямо в нее.
+        """
+        with self._lock:
+            image = self._pages.pop(index, None) if self.exclusive else self._pages.get(index)
+        if image is None:
+            return self._load_page(index)
+        if self.exclusive:
+            return image
+        copy = image.copy()
+        frame_cache.restore_dots(image, copy)
+        return copy
+
+    def _load_page(self, index) -> QImage:
+        """Страница из дискового кэша кадров или декодированная (в память не кладется)"""
+        frame_key = self._frame_key(index) if frame_cache.enabled else None
+        image = self._cached_frame(index, frame_key) if frame_key else None
+        if image is None:
+            with perf_log.stage("decode", page=index, **file_info(self.path)) as record:
+                image = self._decode_page(index)
+                record.update(image_info(image))
+            if frame_key and not image.isNull():
+                image = frame_cache.store(frame_key, image)
+        return image
+
+    def _cached_frame(self, index, frame_key):
+        with perf_log.stage("frame_load", page=index, **file_info(self.path)) as record:
+            image = frame_cache.load(frame_key)
+            record["hit"] = image is not None
+        return image
+
+    def _has_frame(self, index) -> bool:
+        frame_key = self._frame_key(index) if frame_cache.enabled else None
+        return frame_key is not None and frame_cache.contains(frame_key)
+
+    def _frame_key(self, index):
+        return self._source_key(f"{type(self).__name__}:{index}")
+
+    def _source_key(self, variant):
+        try:
+            return source_key(self.path, variant)
+        except OSError:
+            return None  # Файл пропал — декодирование сообщит об ошибке само
+
+    def preview(self, index, width) -> QImage:
+        """Уменьшенная страница шириной не больше width.
+
+        Без полного декодирования — если формат умеет уменьшать при чтении
+        (reduced_preview). Иначе уменьшенное чтение стоит столько же, сколько
+        полное, поэтому страница декодируется один раз и остается в памяти
+        для подписания, а превью получается из нее. Страница, которая уже
+        есть в кэше кадров, берется оттуда для любого формата.
+        """
+        with self._lock:
+            image = self._pages.get(index)
+        if image is None and (not self.reduced_preview or self._has_frame(index)):
+            image = self.page(index)
+        if image is not None:
+            if image.isNull() or image.width() <= width:
+                return image
+            with perf_log.stage("preview_scale", page=index, **image_info(image)):
+                return image.scaledToWidth(width, Qt.SmoothTransformation)
+
+        with perf_log.stage("decode_preview", page=index, **file_info(self.path)) as record:
+            image = self._decode_preview(index, width)
+            record.update(image_info(image))
+        return image
+
+    def _decode_page(self, index) -> QImage:
+        raise NotImplementedError
+
+    def _decode_preview(self, index, width) -> QImage:
+        raise NotImplementedError
+
+    def write_signed(self, engine, placements, output_path, encoder=None) -> bool:
+        """Записывает подписанную копию; страницы без элементов не перекодируются"""
+        pages = placements_by_page(placements, self.page_count())
+        if not pages and Path(output_path).suffix.lower() == self.path.suffix.lower():
+            shutil.copyfile(self.path, output_path)
+            return True
+        # Блокировка документа берется только на чтение страниц: сборку и кодирование
+        # (секунды на больших страницах) не ждут ни показ, ни закрытие документа
+        with perf_log.stage("sign", pages=len(pages), output=str(output_path), **file_info(self.path)):
+            return self._write_signed(engine, pages, output_path, encoder)
+
+    def _write_signed(self, engine, pages, output_path, encoder) -> bool:
+        raise NotImplementedError
+
+    def close(self):
+        with self._lock:
+            self._pages.clear()
+
+
+def read_scaled(reader, width) -> QImage:
+    """Чтение с уменьшением на этапе декодирования (для JPEG — масштабирование DCT)"""
+    size = reader.size()
+    if size.isValid() and size.width() > width:
+        reader.setScaledSize(size.scaled(width, size.height(), Qt.KeepAspectRatio))
+    return reader.read()
+
+
+class RasterDocument(DocumentSource):
+    """Одностраничное изображение (png, jpg, bmp)"""
+
+    def __init__(self, path):
+        super().__init__(path)
+        # Уменьшение при декодировании есть только у JPEG (масштабирование DCT)
+        self.reduced_preview = self.path.suffix.lower() in {'.jpg', '.jpeg'}
+
+    def page_count(self) -> int:
+        return 1
+
+    def _decode_page(self, index) -> QImage:
+        return QImage(str(self.path))
+
+    def _decode_preview(self, index, width) -> QImage:
+        return read_scaled(QImageReader(str(self.path)), width)
+
+    def _write_signed(self, engine, pages, output_path, encoder) -> bool:
+        page = self._page_for_signing(0)
+        final_image = engine.compose(page, pages.get(0, []), in_place=True)
+        if final_image is not None:
+            frame_cache.restore_dots(page, final_image)
+        return final_image is not None and save_image(final_image, output_path, encoder)
+
+
+class TiffDocument(DocumentSource):
+    """Многостраничный TIFF: страницы читаются по одной через QImageReader"""
+
+    def __init__(self, path):
+        super().__init__(path)
+        self._page_count = None
+
+    def page_count(self) -> int:
+        if self._page_count is None:
+            self._page_count = max(QImageReader(str(self.path)).imageCount(), 1)
+        return self._page_count
+
+    def _decode_page(self, index) -> QImage:
+        reader = QImageReader(str(self.path))
+        if index and not reader.jumpToImage(index):
+            return QImage()
+        return reader.read()
+
+    def _write_signed(self, engine, pages, output_path, encoder) -> bool:
+        # Qt не умеет писать многостраничный TIFF. Страницы без элементов копируются
+        # байт в байт, со своим сжатием и без декодирования; перекодируются только
+        # страницы с элементами. Они сжимаются в памяти до того, как начнется запись
+        # файла, так что ошибка сборки не оставляет недописанную копию
+        with open(self.path, "rb") as source:
+            try:
+                source_pages = TiffPages(source)
+            except ValueError:
+                source_pages = None  # BigTIFF: страницы перекодируются все
+
+            encoded = {}
+            for index in range(self.page_count()):
+                if index in pages:
+                    final_image = engine.compose(self._page_for_signing(index), pages[index], in_place=True)
+                    if final_image is None:
+                        return False
+                    encoded[index] = self._encode_page(index, qimage_to_pil(final_image))
+                elif source_pages is None or not source_pages.copyable(index):
+                    encoded[index] = self._encode_page(index)
+
+            try:
+                with open(output_path, "wb") as output:
+                    writer = TiffPageWriter(output, source_pages.order if source_pages else "<")
+                    for index in range(self.page_count()):
+                        if index in encoded:
+                            writer.add_page(encoded[index], 0)
+                        else:
+                            writer.add_page(source_pages, index)
+            except BaseException:
+                Path(output_path).unlink(missing_ok=True)
+                raise
+        return True
+
+    def _encode_page(self, index, frame=None) -> TiffPages:
+        """Страница, сжатая LZW в памяти (frame=None — кадр исходника как есть)"""
+        from PIL import Image
+
+        buffer = io.BytesIO()
+        with Image.open(self.path) as source:
+            source.seek(index)
+            (frame or source).save(buffer, format="TIFF", compression="tiff_lzw", dpi=source.info.get("dpi", (72, 72)))
+        return TiffPages(buffer)
+
+
+class PdfDocument(DocumentSource):
+    """PDF: страницы растеризуются только для показа.
+
+    При подписании печати и подписи встраиваются в страницы как изображения,
+    сами страницы PDF остаются нетронутыми.
+    """
+
+    reduced_preview = True  # Страница растеризуется сразу с нужным разрешением
+
+    def __init__(self, path):
+        super().__init__(path)
+        self._document = load_fitz().open(str(self.path))
+
+    def page_count(self) -> int:
+        return self._document.page_count
+
+    def _decode_page(self, index) -> QImage:
+        return self._render(index, PDF_RENDER_DPI)
+
+    def _frame_key(self, index):
+        return self._source_key(f"{type(self).__name__}:{index}@{PDF_RENDER_DPI}")
+
+    def _decode_preview(self, index, width) -> QImage:
+        with self._lock:
+            page_width_inch = self._document[index].rect.width / 72
+            return self._render(index, min(PDF_RENDER_DPI, int(width / page_width_inch)))
+
+    def _render(self, index, dpi) -> QImage:
+        # PyMuPDF не потокобезопасен: растеризация, запись и закрытие идут по очереди
+        with self._lock:
+            pixmap = self._document[index].get_pixmap(dpi=dpi, alpha=False)
+        image = QImage(pixmap.samples, pixmap.width, pixmap.height, pixmap.stride, QImage.Format_RGB888)
+        return image.copy()  # Отвязываемся от буфера PyMuPDF
+
+    def _write_signed(self, engine, pages, output_path, encoder) -> bool:
+        # PyMuPDF не потокобезопасен: растеризация страниц документа ждет записи.
+        # Окно на время сохранения не дает листать и менять документ, так что ждут только рабочие потоки
+        with self._lock:
+            return self._write_pdf(engine, pages, output_path)
+
+    def _write_pdf(self, engine, pages, output_path) -> bool:
+        fitz = load_fitz()
+        # Пишем в отдельную копию, чтобы открытый для показа документ не менялся
+        document = fitz.open(str(self.path))
+        inserted = {}  # (тип, размер, поворот) -> xref, чтобы одинаковые элементы хранились в файле один раз
+        for index, page_placements in pages.items():
+            page = document[index]
+            # Та же модель, что и для растра: ширина страницы соответствует ширине листа A4
+            page_width_mm = A4_HEIGHT_MM if page.rect.width > page.rect.height else A4_WIDTH_MM
+            pt_per_mm = page.rect.width / page_width_mm
+
+            for placement in page_placements:
+                element_image = engine.images.get(placement.element_type)
+                if element_image is None or element_image.isNull():
+                    continue
+
+                width_mm, height_mm = engine.placement_size_mm(placement)
+                # Повернутый элемент встраивается растром с прозрачными углами в описанный прямоугольник
+                x_mm, y_mm, bounds_width, bounds_height = rotated_bounds_mm(
+                    placement.x_mm, placement.y_mm, width_mm, height_mm, placement.rotation)
+                rect = fitz.Rect(
+                    page.rect.x0 + x_mm * pt_per_mm,
+                    page.rect.y0 + y_mm * pt_per_mm,
+                    page.rect.x0 + (x_mm + bounds_width) * pt_per_mm,
+                    page.rect.y0 + (y_mm + bounds_height) * pt_per_mm
+                )
+                # Превью показывает страницу с учетом /Rotate, а insert_image() ждет координаты
+                # неповернутой страницы; изображение доворачивается, чтобы на экране стоять прямо
+                rect = rect * page.derotation_matrix
+
+                key = (placement.element_type, placement.scale, placement.rotation)
+                xref = inserted.get(key)
+                if xref is None:
+                    image = stamp_rendition(element_image, width_mm, height_mm)
+                    if placement.rotation:
+                        image = renditions.rotated(image, image.size(), placement.rotation)
+                    inserted[key] = page.insert_image(rect, stream=encode_png(image), rotate=page.rotation)
+                else:
+                    page.insert_image(rect, xref=xref, rotate=page.rotation)
+
+        document.save(str(output_path), garbage=1, deflate=True)
+        document.close()
+        return True
+
+    def close(self):
+        with self._lock:
+            super().close()
+            self._document.close()
+
+
+def stamp_rendition(element_image, width_mm, height_mm):
+    """Копия элемента с разрешением PDF_STAMP_DPI (не больше оригинала)"""
+    size = QSize(round(width_mm / 25.4 * PDF_STAMP_DPI), round(height_mm / 25.4 * PDF_STAMP_DPI))
+    if size.width() >= element_image.width() or size.isEmpty():
+        return element_image
+    return renditions.scaled(element_image, size)
+
+
+def encode_png(image) -> bytes:
+    data = QByteArray()
+    buffer = QBuffer(data)
+    buffer.open(QIODevice.WriteOnly)
+    image.save(buffer, "PNG")
+    buffer.close()
+    return bytes(data)
+
+
+def qimage_to_pil(image):
+    from PIL import Image
+
+    rgb = image.convertToFormat(QImage.Format_RGB888)
+    bits = rgb.constBits()
+    bits.setsize(rgb.sizeInBytes())
+    return Image.frombuffer("RGB", (rgb.width(), rgb.height()), bits.asstring(), "raw", "RGB", rgb.bytesPerLine(), 1)
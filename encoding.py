@@ -0,0 +1,67 @@
+from pathlib import Path
+
+from PyQt5.QtGui import QImage, QImageWriter
+
+from perf import file_info, image_info, perf_log
+
+# Форматы сохранения: ключ настройки -> (формат Qt, расширение)
+SAVE_FORMATS = {
+    'png': ('png', '.png'),
+    'jpg': ('jpeg', '.jpg'),
+}
+
+
+class EncoderSettings:
+    """Параметры кодирования подписанного растра.
+
+    format — 'png', 'jpg' или '' (как у исходного файла), quality — качество
+    JPEG (0–100), png_compression — уровень zlib для PNG (0 — быстро, 9 — компактно).
+    """
+
+    def __init__(self, format='', quality=90, png_compression=1):
+        self.format = format
+        self.quality = quality
+        self.png_compression = png_compression
+
+    @classmethod
+    def from_settings(cls, settings: dict):
+        return cls(settings['save_format'], settings['save_quality'], settings['png_compression'])
+
+    def to_dict(self) -> dict:
+        return {"format": self.format, "quality": self.quality, "png_compression": self.png_compression}
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        return cls(data["format"], data["quality"], data["png_compression"])
+
+    def suffix(self, source_suffix) -> str:
+        """Расширение результата: выбранный формат или расширение исходника"""
+        if self.format in SAVE_FORMATS:
+            return SAVE_FORMATS[self.format][1]
+        return source_suffix
+
+
+def save_image(image, path, settings=None) -> bool:
+    settings = settings or EncoderSettings()
+    writer = QImageWriter(str(path))
+
+    if settings.format in SAVE_FORMATS:
+        image_format = SAVE_FORMATS[settings.format][0]
+        writer.setFormat(image_format.encode())
+    else:
+        image_format = Path(path).suffix.lstrip('.').lower()
+
+    if image_format in ('jpg', 'jpeg'):
+        writer.setQuality(settings.quality)
+        writer.setOptimizedWrite(True)
+        if image.hasAlphaChannel():
+            image = image.convertToFormat(QImage.Format_RGB32)  # В JPEG нет прозрачности
+    elif image_format == 'png':
+        # Плагин PNG переводит quality в уровень zlib как (100 - quality) * 9 / 91
+        level = max(0, min(settings.png_compression, 9))
+        writer.setQuality(100 - (level * 91 + 8) // 9)
+
+    with perf_log.stage("encode", format=image_format, **image_info(image)) as record:
+        ok = writer.write(image)
+        record.update(file_info(path))
+    return ok
@@ -0,0 +1,243 @@
+import math
+from pathlib import Path
+
+from PyQt5.QtCore import Qt, QPoint, QRect, QSize
+from PyQt5.QtGui import QImage, QPainter
+
+from perf import image_info, perf_log
+from renditions import renditions
+
+# Физические размеры A4 в мм
+A4_WIDTH_MM = 210
+A4_HEIGHT_MM = 297
+
+
+def is_landscape(image):
+    return image.width() > image.height()
+
+
+def px_per_mm(document_image):
+    """Соотношение пикселей документа к миллиметрам листа A4"""
+    if is_landscape(document_image):
+        return document_image.width() / A4_HEIGHT_MM
+    return document_image.width() / A4_WIDTH_MM
+
+
+def element_size_mm(element_width_mm, element_image):
+    """Ширина и высота элемента в мм (высота — по пропорциям изображения)"""
+    return element_width_mm, element_width_mm * element_image.height() / element_image.width()
+
+
+def calculate_element_size(element_width_mm, element_image, document_image):
+    """Размер элемента в пикселях документа (элемент и документ — QImage, QPixmap или QSize)"""
+    scale = px_per_mm(document_image)
+    width_mm, height_mm = element_size_mm(element_width_mm, element_image)
+    return QSize(round(width_mm * scale), round(height_mm * scale))
+
+
+def element_rect(x_mm, y_mm, width_mm, height_mm, scale) -> QRect:
+    """Прямоугольник элемента в пикселях страницы при scale пикселей на мм.
+
+    Каждый край округляется к ближайшему пикселю отдельно, поэтому ошибка
+    не больше полпикселя при любом разрешении и не накапливается.
+    """
+    left, top = round(x_mm * scale), round(y_mm * scale)
+    return QRect(left, top, round((x_mm + width_mm) * scale) - left, round((y_mm + height_mm) * scale) - top)
+
+
+def rotated_bounds_mm(x_mm, y_mm, width_mm, height_mm, rotation):
+    """Описанный прямоугольник элемента, повернутого вокруг своего центра: (x, y, ширина, высота)"""
+    angle = math.radians(rotation)
+    cos, sin = abs(math.cos(angle)), abs(math.sin(angle))
+    bounds_width = width_mm * cos + height_mm * sin
+    bounds_height = width_mm * sin + height_mm * cos
+    return (x_mm + (width_mm - bounds_width) / 2, y_mm + (height_mm - bounds_height) / 2,
+            bounds_width, bounds_height)
+
+
+def signed_output_path(source_path, output_dir=None, suffix=None, keep_suffix=False) -> Path:
+    """Путь для подписанной копии: <имя>_подписано<расширение>.
+
+    keep_suffix оставляет в имени и расширение исходника (a.png_подписано.jpg) —
+    когда при смене формата копии разных исходников получили бы одно имя.
+    """
+    source_path = Path(source_path)
+    target_dir = Path(output_dir) if output_dir else source_path.parent
+    name = source_path.name if keep_suffix else source_path.stem
+    return target_dir / f"{name}_подписано{suffix or source_path.suffix}"
+
+
+# Форматы, в которые QPainter рисует без промежуточного преобразования
+PAINTABLE_FORMATS = (QImage.Format_RGB32, QImage.Format_ARGB32, QImage.Format_ARGB32_Premultiplied)
+
+
+class Placement:
+    """Положение элемента в мм относительно левого верхнего угла страницы.
+
+    scale — множитель к общему размеру печати или подписи из настроек,
+    rotation — поворот в градусах по часовой стрелке вокруг центра элемента;
+    x_mm, y_mm — угол элемента до поворота.
+    """
+
+    def __init__(self, element_type, x_mm, y_mm, page=0, scale=1.0, rotation=0.0):
+        self.element_type = element_type
+        self.x_mm = x_mm
+        self.y_mm = y_mm
+        self.page = page
+        self.scale = scale
+        self.rotation = rotation
+
+    def copy(self):
+        return Placement(self.element_type, self.x_mm, self.y_mm, self.page, self.scale, self.rotation)
+
+    def to_dict(self) -> dict:
+        data = {"type": self.element_type, "page": self.page, "x_mm": self.x_mm, "y_mm": self.y_mm}
+        # Шаблоны без размера и поворота остаются прежнего вида
+        if self.scale != 1.0:
+            data["scale"] = self.scale
+        if self.rotation:
+            data["rotation"] = self.rotation
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        return cls(data["type"], float(data["x_mm"]), float(data["y_mm"]), int(data.get("page", 0)),
+                   float(data.get("scale", 1.0)), float(data.get("rotation", 0.0)))
+
+
+class PlacementLayout:
+    """Все элементы документа по страницам, в мм листа.
+
+    Единственное хранилище положений: редактор показывает элементы текущей
+    страницы и сообщает о перемещениях, а превью при любом масштабе и
+    подписание при любом разрешении считаются из этих же чисел.
+    """
+
+    def __init__(self, placements=()):
+        self._pages = {}
+        for placement in placements:
+            self.add(placement)
+
+    def __len__(self):
+        return sum(len(page) for page in self._pages.values())
+
+    def placements(self) -> list:
+        return [placement for index in sorted(self._pages) for placement in self._pages[index]]
+
+    def page(self, index) -> list:
+        return list(self._pages.get(index, []))
+
+    def add(self, placement) -> Placement:
+        self._pages.setdefault(placement.page, []).append(placement)
+        return placement
+
+    def move(self, placement, x_mm, y_mm) -> None:
+        placement.x_mm = x_mm
+        placement.y_mm = y_mm
+
+    def transform(self, placement, x_mm, y_mm, scale, rotation) -> None:
+        """Положение, размер и поворот элемента (размер меняется вокруг центра, поэтому и положение)"""
+        self.move(placement, x_mm, y_mm)
+        placement.scale = scale
+        placement.rotation = rotation
+
+    def remove(self, placement) -> None:
+        page = self._pages.get(placement.page, [])
+        if placement in page:
+            page.remove(placement)
+
+    def clear(self) -> None:
+        self._pages.clear()
+
+
+class SigningEngine:
+    """Сборка подписанного документа без виджетов: только QImage и координаты в мм"""
+
+    def __init__(self, stamp, signature, stamp_size, sign_size):
+        self.images = {'stamp': stamp, 'signature': signature}
+        self.sizes_mm = {'stamp': stamp_size, 'signature': sign_size}
+
+    def element_size_mm(self, element_type, scale=1.0):
+        return element_size_mm(self.sizes_mm[element_type] * scale, self.images[element_type])
+
+    def placement_size_mm(self, placement):
+        return self.element_size_mm(placement.element_type, placement.scale)
+
+    def compose(self, document, placements, in_place=False):
+        """Накладывает элементы на документ.
+
+        При in_place=True меняются только прямоугольники печатей и подписей прямо
+        в декодированном изображении — без второго полноразмерного буфера и
+        перерисовки всей страницы. Переданный document при этом изменяется.
+        """
+        if document is None or document.isNull():
+            return None
+
+        with perf_log.stage("compose", elements=len(placements), in_place=in_place, **image_info(document)):
+            return self._compose(document, placements, in_place)
+
+    def _compose(self, document, placements, in_place):
+        if in_place:
+            final_image = self._paintable(document)
+            painter = QPainter(final_image)
+            if final_image.hasAlphaChannel():
+                # Подкладываем белый фон под прозрачные участки в том же буфере
+                painter.setCompositionMode(QPainter.CompositionMode_DestinationOver)
+                painter.fillRect(final_image.rect(), Qt.white)
+                painter.setCompositionMode(QPainter.CompositionMode_SourceOver)
+        else:
+            # Создаем изображение с размером оригинального документа
+            final_image = QImage(document.size(), QImage.Format_RGB32)
+            final_image.fill(Qt.white)  # Белый фон
+
+            # Рисуем на нем оригинальный документ
+            painter = QPainter(final_image)
+            painter.drawImage(0, 0, document)
+
+        self._draw_elements(painter, document, placements)
+        painter.end()
+        return final_image
+
+    @staticmethod
+    def _paintable(document):
+        """QPainter умеет рисовать не во все форматы (индексные, монохромные, серые)"""
+        if document.format() in PAINTABLE_FORMATS:
+            return document
+        if document.hasAlphaChannel():
+            return document.convertToFormat(QImage.Format_ARGB32_Premultiplied)
+        return document.convertToFormat(QImage.Format_RGB32)
+
+    def _draw_elements(self, painter, document, placements):
+        scale = px_per_mm(document)
+        for placement in placements:
+            element_image = self.images.get(placement.element_type)
+            if element_image is None or element_image.isNull():
+                continue
+
+            width_mm, height_mm = self.placement_size_mm(placement)
+            rect = element_rect(placement.x_mm, placement.y_mm, width_mm, height_mm, scale)
+            if rect.isEmpty():
+                continue
+
+            if not placement.rotation:
+                # Масштабируем оригинальное изображение (копия берется из общего кэша)
+                scaled_element = renditions.scaled(element_image, rect.size())
+                painter.drawImage(rect.topLeft(), scaled_element)
+                continue
+
+            # Повернутая копия того же размера в пикселях тоже строится один раз
+            rotated = renditions.rotated(element_image, rect.size(), placement.rotation)
+            center_x = (placement.x_mm + width_mm / 2) * scale
+            center_y = (placement.y_mm + height_mm / 2) * scale
+            painter.drawImage(QPoint(round(center_x - rotated.width() / 2), round(center_y - rotated.height() / 2)),
+                              rotated)
+
+    def sign_file(self, input_path, output_path, placements, encoder=None) -> bool:
+        """Подписывает файл любого поддерживаемого формата (растр, TIFF, PDF)"""
+        from documents import open_document
+
+        document = open_document(input_path)
+        try:
+            return document.write_signed(self, placements, output_path, encoder)
+        finally:
+            document.close()
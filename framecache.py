@@ -0,0 +1,155 @@
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import threading
+from pathlib import Path
+
+from PyQt5 import sip
+from PyQt5.QtGui import QImage
+
+from config import DEFAULT_CACHE_DIR
+from perf import perf_log
+
+# Заголовок файла кадра: метка, ширина, высота, байт на строку, формат, точки на метр по X и Y
+HEADER = struct.Struct("<4sIIIIII")
+HEADER_SIZE = 64  # Пиксели начинаются с выровненного смещения
+MAGIC = b"DSF1"
+
+# Форматы, которые хранятся как есть; индексные и монохромные переводятся в 32 бита
+STORED_FORMATS = {
+    QImage.Format_RGB32,
+    QImage.Format_ARGB32,
+    QImage.Format_ARGB32_Premultiplied,
+    QImage.Format_RGB888,
+    QImage.Format_Grayscale8,
+}
+
+
+def source_key(path, variant="") -> str:
+    """Ключ кадра: путь, размер и время изменения файла плюс номер страницы и т. п."""
+    stat = os.stat(path)
+    text = f"{Path(path).resolve()}|{stat.st_size}|{stat.st_mtime_ns}|{variant}"
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class FrameCache:
+    """Дисковый кэш декодированных страниц.
+
+    Кадр хранится как заголовок и сырые строки пикселей QImage. При чтении
+    файл отображается в память, и QImage строится прямо над отображением,
+    без копирования и декодирования; страницы подгружаются системой по мере
+    обращения. Отображение открыто с копированием при записи: рисование
+    на такой странице меняет только страницы памяти процесса, не файл.
+
+    Объем ограничен max_bytes; при превышении удаляются кадры, к которым
+    дольше всего не обращались (время изменения файла обновляется при
+    каждом чтении). max_bytes = 0 выключает кэш.
+    """
+
+    def __init__(self, root, max_bytes=0):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def configure(self, root, max_bytes) -> None:
+        with self._lock:
+            self.root = Path(root)
+            self.max_bytes = max_bytes
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def frame_path(self, key) -> Path:
+        return self.root / f"{key}.frame"
+
+    def contains(self, key) -> bool:
+        return self.enabled and self.frame_path(key).exists()
+
+    def load(self, key):
+        """QImage над отображенным в память кадром или None"""
+        if not self.enabled:
+            return None
+        path = self.frame_path(key)
+        try:
+            with open(path, "rb") as frame_file:
+                mapped = mmap.mmap(frame_file.fileno(), 0, access=mmap.ACCESS_COPY)
+            os.utime(path)  # Отметка для вытеснения давно не нужных кадров
+        except (OSError, ValueError):
+            return None
+        if len(mapped) < HEADER_SIZE:
+            return None
+
+        magic, width, height, stride, image_format, dots_x, dots_y = HEADER.unpack_from(mapped)
+        if magic != MAGIC or len(mapped) < HEADER_SIZE + stride * height:
+            return None
+        pixels = memoryview(mapped)[HEADER_SIZE:HEADER_SIZE + stride * height]
+        image = QImage(sip.voidptr(pixels), width, height, stride, QImage.Format(image_format))
+        # QImage не владеет буфером: отображение живет, пока жива ссылка на него
+        image.frame_buffer = pixels
+        # setDotsPerMeterX() скопировал бы буфер — разрешение хранится рядом
+        # и переносится на подписанную копию (см. restore_dots)
+        image.frame_dots = (dots_x, dots_y)
+        return image
+
+    def store(self, key, image) -> QImage:
+        """Записывает кадр; возвращает изображение в хранимом формате"""
+        if not self.enabled or image.isNull():
+            return image
+        if image.format() not in STORED_FORMATS:
+            image_format = QImage.Format_ARGB32_Premultiplied if image.hasAlphaChannel() else QImage.Format_RGB32
+            image = image.convertToFormat(image_format)
+        size = HEADER_SIZE + image.sizeInBytes()
+        if size > self.max_bytes:
+            return image
+
+        with perf_log.stage("frame_store", bytes=size):
+            self.root.mkdir(parents=True, exist_ok=True)
+            header = HEADER.pack(MAGIC, image.width(), image.height(), image.bytesPerLine(), int(image.format()),
+                                 image.dotsPerMeterX(), image.dotsPerMeterY())
+            bits = image.constBits()
+            bits.setsize(image.sizeInBytes())
+            # Пишем под временным именем: другой процесс не увидит недописанный кадр
+            fd, temp_path = tempfile.mkstemp(prefix=".frame-", suffix=".tmp", dir=str(self.root))
+            try:
+                with os.fdopen(fd, "wb") as frame_file:
+                    frame_file.write(header.ljust(HEADER_SIZE, b"\0"))
+                    frame_file.write(memoryview(bits))
+                os.replace(temp_path, self.frame_path(key))
+            except OSError:
+                Path(temp_path).unlink(missing_ok=True)
+                return image
+            self.evict()
+        return image
+
+    def evict(self) -> None:
+        """Удаляет самые давние кадры, пока объем больше max_bytes"""
+        with self._lock:
+            try:
+                stats = [(entry.path, entry.stat()) for entry in os.scandir(self.root) if entry.name.endswith(".frame")]
+            except OSError:
+                return
+            entries = sorted((stat.st_mtime_ns, stat.st_size, path) for path, stat in stats)
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue  # В Windows отображенный файл удалить нельзя — останется до следующего раза
+                total -= size
+
+    @staticmethod
+    def restore_dots(frame, image) -> None:
+        """Переносит разрешение кадра из кэша на изображение, полученное из него"""
+        dots = getattr(frame, "frame_dots", None)
+        if dots is not None:
+            image.setDotsPerMeterX(dots[0])
+            image.setDotsPerMeterY(dots[1])
+
+
+# Общий кэш процесса; включается настройкой frame_cache_mb
+frame_cache = FrameCache(DEFAULT_CACHE_DIR / "frames")
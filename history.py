@@ -0,0 +1,88 @@
+from PyQt5.QtWidgets import QUndoCommand
+
+# Сколько шагов хранится; команда — ссылка на Placement и пара координат, так что это килобайты
+UNDO_LIMIT = 500
+
+
+class PlacementCommand(QUndoCommand):
+    """Изменение размещения, которое можно отменить.
+
+    Команда хранит только сам Placement (его же держит модель размещения)
+    и числа, которые изменились; изображения не копируются. Изменения
+    применяются через editor — контроллер, который обновляет модель и сцену.
+    При отмене и повторе editor показывает страницу, на которой элемент.
+    """
+
+    def __init__(self, editor, placement, text):
+        super().__init__(text)
+        self.editor = editor
+        self.placement = placement
+        self._pushed = False  # Первый redo() выполняет сам QUndoStack.push()
+
+    def redo(self):
+        if self._pushed:
+            self.editor.reveal_placement(self.placement)
+        self._pushed = True
+        self.apply()
+
+    def undo(self):
+        self.editor.reveal_placement(self.placement)
+        self.revert()
+
+    def apply(self):
+        raise NotImplementedError
+
+    def revert(self):
+        raise NotImplementedError
+
+
+class AddPlacementCommand(PlacementCommand):
+    def __init__(self, editor, placement):
+        super().__init__(editor, placement, "добавление элемента")
+
+    def apply(self):
+        self.editor.insert_placement(self.placement)
+
+    def revert(self):
+        self.editor.take_placement(self.placement)
+
+
+class RemovePlacementCommand(PlacementCommand):
+    def __init__(self, editor, placement):
+        super().__init__(editor, placement, "удаление элемента")
+
+    def apply(self):
+        self.editor.take_placement(self.placement)
+
+    def revert(self):
+        self.editor.insert_placement(self.placement)
+
+
+class MovePlacementCommand(PlacementCommand):
+    """Перемещение; элемент к моменту записи команды уже стоит на новом месте"""
+
+    def __init__(self, editor, placement, old_position, new_position):
+        super().__init__(editor, placement, "перемещение элемента")
+        self.old_position = old_position
+        self.new_position = new_position
+
+    def apply(self):
+        self.editor.set_placement_position(self.placement, *self.new_position)
+
+    def revert(self):
+        self.editor.set_placement_position(self.placement, *self.old_position)
+
+
+class TransformPlacementCommand(PlacementCommand):
+    """Размер и поворот; геометрия — (x_mm, y_mm, scale, rotation)"""
+
+    def __init__(self, editor, placement, old_geometry, new_geometry):
+        super().__init__(editor, placement, "изменение размера и поворота")
+        self.old_geometry = old_geometry
+        self.new_geometry = new_geometry
+
+    def apply(self):
+        self.editor.set_placement_geometry(self.placement, *self.new_geometry)
+
+    def revert(self):
+        self.editor.set_placement_geometry(self.placement, *self.old_geometry)
@@ -1,11 +1,61 @@
+import time
+
+STARTED = time.perf_counter()  # До импорта Qt: в замер запуска входит и он
+
+import argparse
+import multiprocessing
 import sys
+from PyQt5.QtCore import QTimer
 from PyQt5.QtWidgets import QApplication
 from view import DocumentSigningView
 from controller import DocumentSigningController
+from perf import perf_log
+from tasks import task_pool
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Подписание документов")
+    commands = parser.add_subparsers(dest="command")
+    # Выйти сразу после показа окна (замер времени запуска, см. build.py)
+    parser.add_argument("--startup-check", action="store_true", help=argparse.SUPPRESS)
+    # Модули подкоманд тянут пул процессов; окну они не нужны, поэтому импортируются только для своей команды
+    command = argv[0] if argv else None
+
+    # Пакетное подписание без окна
+    batch_parser = commands.add_parser("batch", help="Подписать все документы каталога по шаблону")
+    if command == "batch":
+        import batch
+        batch.add_arguments(batch_parser)
+
+    # Служба: подписывает документы, появляющиеся в папке входящих
+    watch_parser = commands.add_parser("watch", help="Следить за папкой входящих и подписывать новые документы")
+    if command == "watch":
+        import watch
+        watch.add_arguments(watch_parser)
+
+    # Остальные аргументы (например, -style) передаем Qt
+    return parser.parse_known_args(argv)
+
+
+def on_started(app, quit_after_start):
+    perf_log.write({"stage": "startup", "ts": round(time.time(), 3), "ms": round((time.perf_counter() - STARTED) * 1000, 2)})
+    if quit_after_start:
+        app.quit()
 
 
 def main():
-    app = QApplication(sys.argv)
+    # В собранной программе процессы пула (spawn) запускают этот же исполняемый файл:
+    # freeze_support() выполняет в них задачу и не дает дойти до окна
+    multiprocessing.freeze_support()
+    args, qt_args = parse_args(sys.argv[1:])
+    if args.command == "batch":
+        import batch
+        sys.exit(batch.run_from_args(args))
+    if args.command == "watch":
+        import watch
+        sys.exit(watch.run_from_args(args))
+
+    app = QApplication(sys.argv[:1] + qt_args)
 
     # Настройка стилей
     app.setStyleSheet("""
@@ -30,8 +80,15 @@ def main():
 
     # Показываем окно
     view.show()
-    sys.exit(app.exec_())
+    # Первый проход цикла событий — окно отрисовано
+    QTimer.singleShot(0, lambda: on_started(app, args.startup_check))
+    exit_code = app.exec_()
+
+    # Дожидаемся фоновых задач, чтобы не оборвать сохранение документа
+    task_pool().waitForDone()
+    controller.config.flush()
+    sys.exit(exit_code)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,135 @@
+import hashlib
+import json
+import shutil
+import threading
+import time
+from pathlib import Path
+
+from config import append_json_lines, read_json_lines
+from perf import perf_log
+from renditions import renditions
+
+MANIFEST_NAME = "manifest.jsonl"
+
+
+def file_sha256(path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as source:
+        for chunk in iter(lambda: source.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class SigningRequest:
+    """Все, от чего зависит подписанная копия: исходник, элементы, размещение и кодирование.
+
+    Элементы описываются хэшем пикселей (тем же, что у кэша копий) и
+    размером в мм. Размещение "auto" — автоматическая расстановка: она
+    однозначно определяется остальными входными данными.
+    """
+
+    def __init__(self, source, engine, placements, encoder=None):
+        self.source = str(source)
+        self.source_sha256 = file_sha256(source)
+        self.elements = {
+            element_type: renditions.source_hash(image)
+            for element_type, image in engine.images.items() if image is not None and not image.isNull()
+        }
+        self.sizes_mm = {element_type: engine.sizes_mm[element_type] for element_type in self.elements}
+        self.placements = placements if placements == "auto" else [placement.to_dict() for placement in placements]
+        self.encoder = encoder.to_dict() if encoder is not None else None
+        self.key = hashlib.sha256(json.dumps(
+            [self.source_sha256, self.elements, self.sizes_mm, self.placements, self.encoder, Path(source).suffix.lower()],
+            sort_keys=True
+        ).encode("utf-8")).hexdigest()
+
+
+class SigningManifest:
+    """Журнал подписаний в формате JSON-lines: что подписано, чем и что получилось.
+
+    На каждое подписание — строка с хэшами исходника, элементов и
+    результата, размещением и настройками кодирования. По ней аудитор
+    сверяет подписанную копию, не пересобирая ее. Повторный запрос с теми
+    же входными данными не пересобирает документ: если копия на месте и
+    ее хэш совпадает, она остается как есть; если такая копия была
+    сохранена под другим именем, она копируется.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._entries = None  # Ключ запроса -> последняя запись
+        self._lock = threading.Lock()
+
+    @property
+    def entries(self) -> dict:
+        if self._entries is None:
+            self._entries = self._load()
+        return self._entries
+
+    def _load(self) -> dict:
+        return {record["key"]: record for record in read_json_lines(self.path)}
+
+    def reuse(self, request, output_path, recorded_path=None) -> bool:
+        """Готова ли копия для запроса по output_path (при необходимости копирует ее из прежней).
+
+        recorded_path — под каким именем копия попадет в журнал, если она
+        пишется во временный файл и потом переименовывается.
+        """
+        with self._lock:
+            record = self.entries.get(request.key)
+        if record is None:
+            return False
+
+        with perf_log.stage("manifest_reuse", file=request.source) as stage:
+            output_path = Path(output_path)
+            stage["hit"] = _matches(output_path, record["output_sha256"])
+            if stage["hit"]:
+                return True
+            previous = Path(record["output"])
+            if previous != output_path and _matches(previous, record["output_sha256"]):
+                shutil.copyfile(previous, output_path)
+                self.record(request, output_path, 0.0, recorded_path=recorded_path, copied_from=str(previous))
+                stage["hit"] = True
+        return stage["hit"]
+
+    def record(self, request, output_path, elapsed, placements=None, recorded_path=None, copied_from=None) -> None:
+        """Добавляет запись о готовой копии; placements — итоговое размещение для "auto" """
+        record = {
+            "key": request.key,
+            "source": request.source,
+            "source_sha256": request.source_sha256,
+            "elements": request.elements,
+            "sizes_mm": request.sizes_mm,
+            "placements": request.placements,
+            "encoder": request.encoder,
+            "output": str(recorded_path or output_path),
+            "output_sha256": file_sha256(output_path),
+            "ms": round(elapsed * 1000, 1),
+            "ts": round(time.time(), 3),
+        }
+        if placements is not None:
+            record["placed"] = [placement.to_dict() for placement in placements]
+        if copied_from is not None:
+            record["copied_from"] = copied_from
+        with self._lock:
+            append_json_lines(self.path, [record])
+            self.entries[request.key] = record
+
+
+def _matches(path, sha256) -> bool:
+    try:
+        return path.is_file() and file_sha256(path) == sha256
+    except OSError:
+        return False
+
+
+def sign_recorded(manifest, document, engine, placements, output_path, encoder=None, recorded_path=None) -> bool:
+    """write_signed() с проверкой и пополнением журнала подписаний"""
+    request = SigningRequest(document.path, engine, placements, encoder)
+    if manifest.reuse(request, output_path, recorded_path):
+        return True
+    started = time.perf_counter()
+    ok = document.write_signed(engine, placements, output_path, encoder)
+    if ok:
+        manifest.record(request, output_path, time.perf_counter() - started, recorded_path=recorded_path)
+    return ok
@@ -0,0 +1,102 @@
+import atexit
+import os
+import threading
+import time
+from contextlib import contextmanager
+from multiprocessing import util
+from pathlib import Path
+
+from config import DEFAULT_CACHE_DIR, append_json_lines
+
+# После этого размера журнал переименовывается в perf.jsonl.1 и начинается заново
+MAX_LOG_BYTES = 10 * 1024 * 1024
+# Как часто накопленные записи дописываются в файл, с
+FLUSH_INTERVAL = 1.0
+
+
+class PerfLog:
+    """Журнал длительности этапов обработки в формате JSON-lines.
+
+    Каждая строка — один этап: имя, время начала, длительность в мс и
+    произвольные поля (размеры изображения, размер в байтах, путь к файлу).
+
+    write() только добавляет запись в память: каталог кэша может быть на
+    сетевом диске, где каждая запись стоит десятки миллисекунд. Файл
+    дописывает фоновый поток раз в FLUSH_INTERVAL и flush() при выходе.
+    """
+
+    def __init__(self, log_path):
+        self.log_path = Path(log_path)
+        self.enabled = True
+        self._lock = threading.Lock()
+        self._file_lock = threading.Lock()
+        self._pending = []
+        self._flush_pid = None  # Процесс, в котором запущен поток записи
+
+    @contextmanager
+    def stage(self, name, **info):
+        """Замеряет блок кода; поля можно дополнить через возвращаемый словарь"""
+        record = {"stage": name, "ts": round(time.time(), 3), **info}
+        started = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["ms"] = round((time.perf_counter() - started) * 1000, 2)
+            self.write(record)
+
+    def write(self, record: dict) -> None:
+        if not self.enabled:
+            return
+
+        record.setdefault("pid", os.getpid())
+        with self._lock:
+            if self._flush_pid != os.getpid():
+                # Первая запись процесса (или процесс-исполнитель, полученный через fork:
+                # чужие записи из памяти родителя допишет сам родитель)
+                self._pending = []
+                self._start_flushing()
+            self._pending.append(record)
+
+    def _start_flushing(self) -> None:
+        self._flush_pid = os.getpid()
+        threading.Thread(target=self._flush_loop, name="perf-log", daemon=True).start()
+        atexit.register(self.flush)
+        # Исполнители пула завершаются без atexit; их финализаторы multiprocessing вызывает сам
+        util.Finalize(self, self.flush, exitpriority=10)
+
+    def _flush_loop(self) -> None:
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            self.flush()
+
+    def flush(self) -> None:
+        """Дописывает накопленные записи в файл"""
+        with self._lock:
+            records, self._pending = self._pending, []
+        if not records:
+            return
+
+        with self._file_lock:
+            try:
+                if self.log_path.exists() and self.log_path.stat().st_size > MAX_LOG_BYTES:
+                    os.replace(self.log_path, self.log_path.with_name(self.log_path.name + ".1"))
+                append_json_lines(self.log_path, records)
+            except OSError:
+                pass  # Журнал не должен мешать подписанию
+
+
+def image_info(image) -> dict:
+    if image is None or image.isNull():
+        return {}
+    # Формула подходит и для QImage, и для QPixmap
+    return {"width": image.width(), "height": image.height(), "bytes": image.width() * image.height() * image.depth() // 8}
+
+
+def file_info(path) -> dict:
+    try:
+        return {"file": str(path), "file_bytes": Path(path).stat().st_size}
+    except OSError:
+        return {"file": str(path)}
+
+
+perf_log = PerfLog(DEFAULT_CACHE_DIR / "perf.jsonl")
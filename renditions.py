@@ -0,0 +1,110 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+from PyQt5.QtCore import Qt
+from PyQt5.QtGui import QImage, QTransform
+
+from perf import image_info, perf_log
+
+# Пирамида страницы: половина, четверть и восьмая часть разрешения
+PYRAMID_LEVELS = 3
+
+
+def image_hash(image) -> str:
+    """Хэш содержимого QImage (размер, формат и пиксели)"""
+    bits = image.constBits()
+    bits.setsize(image.sizeInBytes())
+    digest = hashlib.sha1(f"{image.width()}x{image.height()}:{image.format()}".encode())
+    digest.update(bits.asstring())
+    return digest.hexdigest()
+
+
+def native_format(image) -> QImage:
+    """Копия в формате, который QPainter и QPixmap.fromImage берут без преобразования.
+
+    ARGB32_Premultiplied, а без прозрачности — RGB32. Переводить стоит в
+    рабочем потоке: потоку интерфейса остается передать готовые пиксели.
+    """
+    target = QImage.Format_ARGB32_Premultiplied if image.hasAlphaChannel() else QImage.Format_RGB32
+    if image.format() == target:
+        return image
+    return image.convertToFormat(target)
+
+
+class RenditionCache:
+    """LRU-кэш масштабированных копий печатей и подписей.
+
+    Ключ — хэш исходного изображения и целевой размер, поэтому одинаковые
+    элементы масштабируются один раз и для превью, и для итогового документа.
+    Копии — QImage в native_format: кэшем пользуются и рабочие потоки.
+    """
+
+    def __init__(self, max_entries=64):
+        self.max_entries = max_entries
+        self._renditions = OrderedDict()
+        self._hashes = OrderedDict()  # cacheKey() -> хэш, чтобы не считать его повторно
+        self._lock = threading.Lock()
+
+    def source_hash(self, image) -> str:
+        key = image.cacheKey()
+        with self._lock:
+            cached = self._hashes.get(key)
+            if cached is not None:
+                self._hashes.move_to_end(key)
+                return cached
+
+        digest = image_hash(image)
+        with self._lock:
+            self._hashes[key] = digest
+            if len(self._hashes) > self.max_entries:
+                self._hashes.popitem(last=False)
+        return digest
+
+    def scaled(self, image, size, transformation=Qt.SmoothTransformation):
+        """Масштабированная копия QImage (с сохранением пропорций)"""
+        key = (self.source_hash(image), size.width(), size.height(), int(transformation))
+        return self._cached(key, lambda: native_format(image.scaled(size, Qt.KeepAspectRatio, transformation)))
+
+    def rotated(self, image, size, rotation, transformation=Qt.SmoothTransformation):
+        """Масштабированная копия, повернутая на rotation градусов; углы прозрачные"""
+        key = (self.source_hash(image), size.width(), size.height(), int(transformation), rotation)
+        return self._cached(key, lambda: native_format(
+            self.scaled(image, size, transformation).convertToFormat(QImage.Format_ARGB32_Premultiplied)
+            .transformed(QTransform().rotate(rotation), transformation)))
+
+    def _cached(self, key, render):
+        with self._lock:
+            rendition = self._renditions.get(key)
+            if rendition is not None:
+                self._renditions.move_to_end(key)
+                return rendition
+
+        rendition = render()
+        with self._lock:
+            self._renditions[key] = rendition
+            if len(self._renditions) > self.max_entries:
+                self._renditions.popitem(last=False)
+        return rendition
+
+
+def build_pyramid(image, min_width=0, levels=PYRAMID_LEVELS) -> list:
+    """Страница и ее копии, каждый раз уменьшенные вдвое, от крупной к мелкой.
+
+    Каждый уровень сглаживается из предыдущего, то есть из вдвое меньшего
+    изображения, а не из полной страницы. Уровни уже min_width не строятся.
+    Уменьшенные уровни сразу переводятся в native_format.
+    """
+    with perf_log.stage("pyramid", **image_info(image)):
+        pyramid = [image]
+        for _ in range(levels):
+            previous = pyramid[-1]
+            width, height = previous.width() // 2, previous.height() // 2
+            if width < min_width or height == 0:
+                break
+            pyramid.append(native_format(previous.scaled(width, height, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)))
+        return pyramid
+
+
+# Общий кэш процесса: им пользуются и превью, и итоговая сборка
+renditions = RenditionCache()
@@ -0,0 +1,56 @@
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+
+
+class TaskSignals(QObject):
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(str)
+
+
+class Task(QRunnable):
+    """Функция, выполняемая в QThreadPool; результат приходит сигналом в GUI-поток"""
+
+    def __init__(self, fn, *args, **kwargs):
+        super().__init__()
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = TaskSignals()
+
+    def run(self):
+        try:
+            result = self.fn(*self.args, **self.kwargs)
+        except Exception as e:
+            self.signals.failed.emit(str(e))
+        else:
+            self.signals.finished.emit(result)
+
+
+_pool = None
+# Держим ссылки на запущенные задачи: иначе Python соберет их вместе с сигналами
+_active_tasks = set()
+
+
+def task_pool() -> QThreadPool:
+    """Отдельный пул для задач приложения.
+
+    Глобальный пул Qt сам использует для многопоточного масштабирования и
+    преобразования форматов; если занять его нашими задачами, на машине с
+    одним ядром декодирование в задаче будет ждать само себя.
+    """
+    global _pool
+    if _pool is None:
+        _pool = QThreadPool()
+    return _pool
+
+
+def run_in_background(fn, *args, on_finished=None, on_failed=None, **kwargs) -> Task:
+    task = Task(fn, *args, **kwargs)
+    if on_finished is not None:
+        task.signals.finished.connect(on_finished)
+    if on_failed is not None:
+        task.signals.failed.connect(on_failed)
+    task.signals.finished.connect(lambda _: _active_tasks.discard(task))
+    task.signals.failed.connect(lambda _: _active_tasks.discard(task))
+    _active_tasks.add(task)
+    task_pool().start(task)
+    return task
@@ -0,0 +1,39 @@
+import json
+from pathlib import Path
+
+from config import atomic_write_text
+from engine import Placement
+
+
+class TemplateStore:
+    """Именованные шаблоны размещения в templates.json рядом с settings.json.
+
+    Шаблон — список элементов с типом, страницей и положением в мм от
+    левого верхнего угла страницы.
+    """
+
+    def __init__(self, cache_dir):
+        self.templates_file = Path(cache_dir) / "templates.json"
+        self.templates = self._load_templates()
+
+    def _load_templates(self) -> dict:
+        if not self.templates_file.exists():
+            return {}
+        return json.loads(self.templates_file.read_text(encoding="utf-8"))
+
+    def names(self) -> list:
+        return sorted(self.templates)
+
+    def get(self, name) -> list:
+        return [Placement.from_dict(item) for item in self.templates.get(name, [])]
+
+    def save(self, name, placements) -> None:
+        self.templates[name] = [placement.to_dict() for placement in placements]
+        self._save_raw()
+
+    def delete(self, name) -> None:
+        if self.templates.pop(name, None) is not None:
+            self._save_raw()
+
+    def _save_raw(self) -> None:
+        atomic_write_text(self.templates_file, json.dumps(self.templates, indent=4, ensure_ascii=False))
@@ -0,0 +1,139 @@
+import struct
+
+# Размер одного значения по типу поля TIFF и его формат для struct (байтовые типы переносятся как есть)
+TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8, 13: 4}
+TYPE_FORMATS = {3: "H", 4: "I", 5: "II", 8: "h", 9: "i", 10: "ii", 11: "f", 12: "d", 13: "I"}
+BYTE_TYPES = {1, 2, 6, 7}
+LONG = 4
+
+# Смещения блоков данных страницы -> их длины
+DATA_TAGS = {273: 279, 324: 325}  # StripOffsets/StripByteCounts, TileOffsets/TileByteCounts
+# Ссылки на вложенные IFD (EXIF, GPS, SubIFD) и свободные участки при копировании отбрасываются
+DROPPED_TAGS = {288, 289, 330, 34665, 34853, 40965}
+# Старый JPEG (сжатие 6) хранит данные по своим смещениям — такие страницы перекодируются
+UNSUPPORTED_TAGS = {513, 514}
+
+COPY_CHUNK = 1024 * 1024
+MAX_OFFSET = 2 ** 32 - 1
+
+
+class TiffPages:
+    """Страницы (IFD) классического TIFF: теги читаются из файла, данные страниц не декодируются"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        stream.seek(0)
+        header = stream.read(8)
+        if header[:4] not in (b"II*\0", b"MM\0*"):
+            raise ValueError("Не классический TIFF")
+        self.order = "<" if header[:2] == b"II" else ">"
+        self.offsets = []
+        offset = self._unpack("I", header[4:8])[0]
+        while offset and offset not in self.offsets:  # Зацикленная цепочка IFD — признак порчи
+            self.offsets.append(offset)
+            stream.seek(offset)
+            count = self._unpack("H", stream.read(2))[0]
+            stream.seek(offset + 2 + 12 * count)
+            offset = self._unpack("I", stream.read(4))[0]
+
+    def _unpack(self, fmt, data) -> tuple:
+        return struct.unpack(self.order + fmt, data)
+
+    def entries(self, index) -> dict:
+        """Теги страницы: номер -> (тип, число значений, значения)"""
+        stream = self.stream
+        stream.seek(self.offsets[index])
+        count = self._unpack("H", stream.read(2))[0]
+        raw_entries = [stream.read(12) for _ in range(count)]
+
+        entries = {}
+        for raw in raw_entries:
+            tag, field_type, value_count = self._unpack("HHI", raw[:8])
+            if field_type not in TYPE_SIZES:
+                continue  # Неизвестный тип не перенести
+            size = TYPE_SIZES[field_type] * value_count
+            if size <= 4:
+                data = raw[8:8 + size]
+            else:
+                stream.seek(self._unpack("I", raw[8:])[0])
+                data = stream.read(size)
+            if field_type in BYTE_TYPES:
+                values = data
+            else:
+                values = self._unpack(TYPE_FORMATS[field_type] * value_count, data)
+            entries[tag] = (field_type, value_count, values)
+        return entries
+
+    def copyable(self, index) -> bool:
+        if index >= len(self.offsets):
+            return False
+        entries = self.entries(index)
+        return (not UNSUPPORTED_TAGS & entries.keys()
+                and any(tag in entries and length_tag in entries for tag, length_tag in DATA_TAGS.items()))
+
+
+class TiffPageWriter:
+    """Пишет многостраничный TIFF из страниц других файлов, копируя их данные байт в байт.
+
+    Сжатые полосы и тайлы страницы не распаковываются: переносятся теги и
+    блоки данных с пересчетом смещений. Порядок байтов берется у исходника,
+    поэтому многобайтовые отсчеты остаются верными.
+    """
+
+    def __init__(self, stream, order="<"):
+        self.stream = stream
+        self.order = order
+        stream.write((b"II*\0" if order == "<" else b"MM\0*") + b"\0\0\0\0")
+        self._next_pointer = 4  # Куда записать смещение следующей страницы
+
+    def _pack(self, fmt, *values) -> bytes:
+        return struct.pack(self.order + fmt, *values)
+
+    def _aligned_tell(self) -> int:
+        position = self.stream.tell()
+        if position % 2:
+            self.stream.write(b"\0")
+            position += 1
+        if position > MAX_OFFSET:
+            raise ValueError("Файл больше 4 ГБ не помещается в классический TIFF")
+        return position
+
+    def add_page(self, pages, index) -> None:
+        entries = pages.entries(index)
+        for tag in DROPPED_TAGS:
+            entries.pop(tag, None)
+
+        for offsets_tag, lengths_tag in DATA_TAGS.items():
+            if offsets_tag not in entries:
+                continue
+            new_offsets = []
+            for offset, length in zip(entries[offsets_tag][2], entries[lengths_tag][2]):
+                new_offsets.append(self._aligned_tell())
+                self._copy(pages.stream, offset, length)
+            entries[offsets_tag] = (LONG, len(new_offsets), tuple(new_offsets))
+
+        fields = []
+        for tag in sorted(entries):
+            field_type, value_count, values = entries[tag]
+            data = values if field_type in BYTE_TYPES else self._pack(TYPE_FORMATS[field_type] * value_count, *values)
+            if len(data) > 4:
+                position = self._aligned_tell()
+                self.stream.write(data)
+                data = self._pack("I", position)
+            fields.append(self._pack("HHI", tag, field_type, value_count) + data.ljust(4, b"\0"))
+
+        ifd_offset = self._aligned_tell()
+        self.stream.write(self._pack("H", len(fields)) + b"".join(fields) + self._pack("I", 0))
+        self.stream.seek(self._next_pointer)
+        self.stream.write(self._pack("I", ifd_offset))
+        self.stream.seek(0, 2)
+        self._next_pointer = ifd_offset + 2 + 12 * len(fields)
+
+    def _copy(self, source, offset, length) -> None:
+        source.seek(offset)
+        while length > 0:
+            chunk = source.read(min(length, COPY_CHUNK))
+            if not chunk:
+                raise ValueError("Данные страницы обрываются")
+            self.stream.write(chunk)
+            length -= len(chunk)
@@ -1,15 +1,31 @@
+import math
+
 from PyQt5.QtWidgets import (
     QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
-    QLabel, QPushButton, QFrame, QGroupBox, QLineEdit
+    QLabel, QPushButton, QFrame, QGroupBox, QLineEdit, QComboBox, QProgressBar, QCheckBox, QToolButton,
+    QGraphicsView, QGraphicsScene, QGraphicsPixmapItem, QGraphicsItem
 )
-from PyQt5.QtCore import Qt, pyqtSignal
+from PyQt5.QtCore import Qt, QPointF, QRectF, QSizeF, pyqtSignal
+from PyQt5.QtGui import QColor, QImage, QPainter, QPen, QPixmap, QTransform
+
+from engine import px_per_mm
+from perf import image_info, perf_log
+
+# Ширина превью документа в области редактирования
+DOCUMENT_PREVIEW_WIDTH = 600
 
 
 class DropGroup(QGroupBox):
-    def __init__(self, title, add_button_text=None, parent=None):
+    def __init__(self, title, add_button_text=None, parent=None, with_library=False):
         super().__init__(title, parent)
         self.layout = QVBoxLayout(self)
 
+        # Ранее загруженные файлы из библиотеки
+        self.asset_combo = None
+        if with_library:
+            self.asset_combo = QComboBox()
+            self.layout.addWidget(self.asset_combo)
+
         # Drop area
         self.drop_frame = QFrame()
         self.drop_frame.setFrameShape(QFrame.StyledPanel)
@@ -73,15 +89,14 @@ class DropGroup(QGroupBox):
         if self.add_button is not None:
             self.add_button.setEnabled(False)
 
-    def set_content(self, pixmap=None, text=None):
-        if pixmap:
-            self.drop_label.setPixmap(pixmap)
+    def set_content(self, image=None, text=None):
+        if image:
+            self.drop_label.setPixmap(QPixmap.fromImage(image))
             self.drop_label.setText("")
             self.clear_button.setEnabled(True)
 
         elif text:
-            self.drop_label.setText(text)
-            self.drop_label.setPixmap(None)
+            self.drop_label.setText(text)  # Текст заменяет и картинку
 
 
     def set_allow_add(self, is_allow):
@@ -100,6 +115,24 @@ class DropGroup(QGroupBox):
 
         self.add_button.setEnabled(is_on)
 
+    def set_assets(self, items, current=None):
+        """items — пары (идентификатор, имя)"""
+        if self.asset_combo is None:
+            return
+
+        self.asset_combo.blockSignals(True)
+        self.asset_combo.clear()
+        self.asset_combo.addItem("Из библиотеки…", None)
+        for asset_id, name in items:
+            self.asset_combo.addItem(name, asset_id)
+        index = self.asset_combo.findData(current) if current else 0
+        self.asset_combo.setCurrentIndex(max(index, 0))
+        self.asset_combo.setEnabled(bool(items))
+        self.asset_combo.blockSignals(False)
+
+    def current_asset(self):
+        return self.asset_combo.currentData() if self.asset_combo is not None else None
+
 
 class LabeledInput(QWidget):
     def __init__(self, label_text="Label", value=""):
@@ -125,6 +158,112 @@ class LabeledInput(QWidget):
         self.input_widget.setText(text)
 
 
+class LabeledCombo(QWidget):
+    def __init__(self, label_text="Label", items=()):
+        super().__init__(None)
+
+        self.label = QLabel(label_text)
+        self.combo = QComboBox()
+        for text, value in items:
+            self.combo.addItem(text, value)
+
+        layout = QHBoxLayout()
+        layout.addWidget(self.label)
+        layout.addWidget(self.combo)
+
+        self.setLayout(layout)
+
+    def value(self):
+        return self.combo.currentData()
+
+    def set_value(self, value):
+        index = self.combo.findData(value)
+        if index >= 0:
+            self.combo.setCurrentIndex(index)
+
+
+class TemplateGroup(QGroupBox):
+    """Выбор, сохранение и удаление шаблонов размещения; режим автоматической расстановки"""
+
+    def __init__(self, title, parent=None):
+        super().__init__(title, parent)
+        self.layout = QVBoxLayout(self)
+
+        self.combo = QComboBox()
+        self.layout.addWidget(self.combo)
+
+        self.buttons_layout = QHBoxLayout()
+        self.apply_button = QPushButton("Применить")
+        self.save_button = QPushButton("Сохранить")
+        self.delete_button = QPushButton("X")
+        self.delete_button.setStyleSheet("""
+            QPushButton {
+                background-color: #f44336;
+                color: white;
+                padding: 5px 10px;
+                border: none;
+                border-radius: 3px;
+                font-weight: bold;
+            }
+            QPushButton:disabled {
+                background-color: #cccccc;
+            }
+        """)
+        self.buttons_layout.addWidget(self.apply_button)
+        self.buttons_layout.addWidget(self.save_button)
+        self.buttons_layout.addWidget(self.delete_button)
+        self.layout.addLayout(self.buttons_layout)
+
+        # Без шаблона элементы ставятся на свободное место страницы, а не в центр
+        self.auto_place_check = QCheckBox("Ставить на свободное место")
+        self.layout.addWidget(self.auto_place_check)
+
+    def set_templates(self, names, current=""):
+        self.combo.blockSignals(True)
+        self.combo.clear()
+        self.combo.addItem("Без шаблона", "")
+        for name in names:
+            self.combo.addItem(name, name)
+        index = self.combo.findData(current)
+        self.combo.setCurrentIndex(max(index, 0))
+        self.combo.blockSignals(False)
+        self.update_buttons()
+
+    def current_template(self) -> str:
+        return self.combo.currentData() or ""
+
+    def update_buttons(self):
+        has_template = bool(self.current_template())
+        self.apply_button.setEnabled(has_template)
+        self.delete_button.setEnabled(has_template)
+
+
+class PageBar(QWidget):
+    """Переключение страниц многостраничного документа"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.prev_button = QPushButton("◀")
+        self.next_button = QPushButton("▶")
+        self.page_label = QLabel()
+        self.page_label.setAlignment(Qt.AlignCenter)
+
+        layout = QHBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.prev_button)
+        layout.addWidget(self.page_label)
+        layout.addWidget(self.next_button)
+
+        self.set_page(0, 0)
+
+    def set_page(self, index, count):
+        # Для одностраничных документов панель не нужна
+        self.setVisible(count > 1)
+        self.page_label.setText(f"Страница {index + 1} из {count}")
+        self.prev_button.setEnabled(index > 0)
+        self.next_button.setEnabled(index < count - 1)
+
+
 class DocumentSigningView(QMainWindow):
     def __init__(self):
         super().__init__()
@@ -133,7 +272,6 @@ class DocumentSigningView(QMainWindow):
         self.sign_button = None
         self.setWindowTitle("Подписание документов")
         self.setGeometry(100, 100, 900, 650)
-        self.doc_label = None
         # Main widget and layout
         self.main_widget = QWidget()
         self.setCentralWidget(self.main_widget)
@@ -159,12 +297,28 @@ class DocumentSigningView(QMainWindow):
 
     def init_ui(self):
         # Create custom drop groups
-        self.stamp_group = DropGroup("Печать:", "Добавить печать")
-        self.signature_group = DropGroup("Подпись:", "Добавить подпись")
+        self.stamp_group = DropGroup("Печать:", "Добавить печать", with_library=True)
+        self.signature_group = DropGroup("Подпись:", "Добавить подпись", with_library=True)
         self.document_group = DropGroup("Документ:")  # Without add button
+        self.template_group = TemplateGroup("Шаблон размещения:")
         self.stamp_size_input = LabeledInput("Диаметр печати (мм):", str(42))
         self.sign_size_input = LabeledInput("Ширина подписи (мм):",  str(20))
 
+        # Параметры сохранения подписанного документа
+        self.save_format_input = LabeledCombo("Формат сохранения:", [
+            ("Как у исходника", ""),
+            ("PNG", "png"),
+            ("JPEG", "jpg"),
+        ])
+        self.save_quality_input = LabeledInput("Качество JPEG (0–100):", str(90))
+        self.png_compression_input = LabeledInput("Сжатие PNG (0–9):", str(1))
+
+        # Индикатор фонового сохранения
+        self.save_progress = QProgressBar()
+        self.save_progress.setRange(0, 0)
+        self.save_progress.setTextVisible(False)
+        self.save_progress.hide()
+
 
         # Sign button
         self.sign_button = QPushButton("Подписать документ")
@@ -187,16 +341,20 @@ class DocumentSigningView(QMainWindow):
         self.left_layout.addWidget(self.stamp_group)
         self.left_layout.addWidget(self.signature_group)
         self.left_layout.addWidget(self.document_group)
+        self.left_layout.addWidget(self.template_group)
         self.left_layout.addStretch()
         self.left_layout.addWidget(self.stamp_size_input)
         self.left_layout.addWidget(self.sign_size_input)
+        self.left_layout.addWidget(self.save_format_input)
+        self.left_layout.addWidget(self.save_quality_input)
+        self.left_layout.addWidget(self.png_compression_input)
         self.left_layout.addWidget(self.sign_button)
+        self.left_layout.addWidget(self.save_progress)
 
         # Document edit area
-        self.document_edit_area = QFrame()
-        self.document_edit_area.setFrameShape(QFrame.StyledPanel)
-        self.document_edit_area.setStyleSheet("""
-            QFrame {
+        self.document_view = DocumentView()
+        self.document_view.setStyleSheet("""
+            QGraphicsView {
                 background-color: #ffffff;
                 border: 2px dashed #aaaaaa;
             }
@@ -222,103 +380,400 @@ class DocumentSigningView(QMainWindow):
 
         # Add components to right column
         # self.right_layout.addWidget(self.trash_area)
-        self.right_layout.addWidget(self.document_edit_area)
-
-
-    def set_document_edit_image(self, pixmap):
+        self.right_layout.addWidget(self.document_view)
+
+        self.page_bar = PageBar()
+        self.right_layout.addWidget(self.page_bar)
+
+        # Отмена и повтор правок размещения; действия задает контроллер
+        self.undo_button = QToolButton()
+        self.redo_button = QToolButton()
+        self.history_layout = QHBoxLayout()
+        self.history_layout.addWidget(self.undo_button)
+        self.history_layout.addWidget(self.redo_button)
+        self.history_layout.addStretch()
+        self.right_layout.insertLayout(0, self.history_layout)
+
+    def set_history_actions(self, undo_action, redo_action):
+        # Действия окна: сочетания клавиш работают, где бы ни был фокус
+        self.addAction(undo_action)
+        self.addAction(redo_action)
+        self.undo_button.setDefaultAction(undo_action)
+        self.redo_button.setDefaultAction(redo_action)
+
+
+    def set_saving(self, is_saving):
+        self.save_progress.setVisible(is_saving)
+        # Пока документ записывается, его нельзя сменить, закрыть или листать
+        self.document_group.setEnabled(not is_saving)
+        self.page_bar.setEnabled(not is_saving)
+        if is_saving:
+            self.statusBar().showMessage("Сохранение документа...")
+
+    def set_document_edit_image(self, image):
         """Устанавливает изображение в основную область редактирования"""
-        # Очищаем предыдущие виджеты в области
-        for child in self.document_edit_area.children():
-            if isinstance(child, QLabel):
-                child.deleteLater()
-
-        # Создаем QLabel для отображения изображения
-        self.doc_label = QLabel(self.document_edit_area)
-        self.doc_label.setAlignment(Qt.AlignCenter)
-        self.doc_label.setScaledContents(False)
-
-        self.doc_label.setStyleSheet("""
-            QLabel {
-                border: none;  # Убираем все границы у QLabel
-                margin: 0px;   # Убираем отступы
-                padding: 0px;  # Убираем внутренние отступы
-            }
-        """)
-
         # Фиксированная ширина
-        fixed_width = 600
+        fixed_width = DOCUMENT_PREVIEW_WIDTH
 
         # Рассчитываем пропорциональную высоту
-        original_width = pixmap.width()
-        original_height = pixmap.height()
+        original_width = image.width()
+        original_height = image.height()
         proportional_height = int((fixed_width / original_width) * original_height)
 
-        # Масштабируем изображение
-        scaled_pixmap = pixmap.scaled(
-            fixed_width,
-            proportional_height,
-            Qt.KeepAspectRatio,
-            Qt.SmoothTransformation
-        )
-
-        # Устанавливаем изображение и фиксируем размер QLabel
-
-        self.doc_label.setPixmap(scaled_pixmap)
-        size = scaled_pixmap.size()
-        self.doc_label.setFixedSize(size)
-
-        # Настраиваем layout для центрирования
-        layout = self.document_edit_area.layout()
-        if layout is None:
-            layout = QVBoxLayout(self.document_edit_area)
-            layout.setContentsMargins(0, 0, 0, 0)
-            layout.setAlignment(Qt.AlignCenter)  # Центрирование по вертикали и горизонтали
-
-        # Добавляем QLabel с выравниванием по центру
-        layout.addWidget(self.doc_label, alignment=Qt.AlignCenter)
-
-
-class DocumentStamp(QLabel):
-    clicked = pyqtSignal()  # Сигнал для будущего взаимодействия
+        # Масштабируем изображение (превью нужной ширины показываем как есть)
+        if original_width == fixed_width:
+            scaled_image = image
+        else:
+            scaled_image = image.scaled(
+                fixed_width,
+                proportional_height,
+                Qt.KeepAspectRatio,
+                Qt.SmoothTransformation
+            )
+
+        self.document_view.set_page(scaled_image)
+
+
+class DocumentView(QGraphicsView):
+    """Область редактирования: страница и элементы в одной сцене.
+
+    Координаты сцены — миллиметры листа, поэтому положение элементов не
+    зависит ни от размера окна, ни от масштаба просмотра. Ctrl+колесо или
+    Ctrl+плюс/минус/0 меняют масштаб, перетаскивание пустого места листает
+    страницу. Страница рисуется с ближайшего по разрешению уровня пирамиды
+    (превью, затем 1/8, 1/4, 1/2 и полная страница, когда они построены).
+    Delete удаляет выделенные элементы.
+    """
+
+    MIN_ZOOM = 0.25
+    MAX_ZOOM = 8.0
+
+    # Элемент перетащен: (Placement, x_mm, y_mm)
+    element_moved = pyqtSignal(object, float, float)
+    # Перетаскивание закончено: [(Placement, (x_mm, y_mm) до начала)] сдвинутых элементов
+    elements_dropped = pyqtSignal(list)
+    # Delete: [Placement] выделенных элементов
+    delete_requested = pyqtSignal(list)
+    # Ручка размера или поворота сдвинута: (Placement, x_mm, y_mm, scale, rotation)
+    element_transformed = pyqtSignal(object, float, float, float, float)
+    # Ручку отпустили: (Placement, (x_mm, y_mm, scale, rotation) до начала)
+    element_transform_finished = pyqtSignal(object, tuple)
 
     def __init__(self, parent=None):
         super().__init__(parent)
-        self.setAttribute(Qt.WA_DeleteOnClose)
+        self.setScene(QGraphicsScene(self))
+        self.setRenderHints(QPainter.Antialiasing | QPainter.SmoothPixmapTransform)
+        self.setDragMode(QGraphicsView.ScrollHandDrag)
+        self.setTransformationAnchor(QGraphicsView.AnchorUnderMouse)
         self.setAlignment(Qt.AlignCenter)
-        self.setStyleSheet("""
-            background-color: rgba(255, 255, 255, 150);
-            border: 1px dashed #888;
-        """)
-        self.setScaledContents(True)
-        self.drag_start_position = None
-        #self.setCursor(Qt.OpenHandCursor)
+        self.setBackgroundBrush(QColor("#eeeeee"))  # Край листа виден и на белом скане
+        self.page_item = None
+        self.page_px_per_mm = 1.0  # Пикселей превью на мм: при масштабе 1 превью показывается 1:1
+        self.levels = []  # Уровни пирамиды по возрастанию ширины (QImage или уже QPixmap)
+        self.level_index = -1
+        self.elements = []  # В порядке добавления
+        self.zoom = 1.0
+        self._drag_start = {}
+
+    def set_page(self, image):
+        """Заменяет страницу; элементы прежней страницы удаляются вместе со сценой"""
+        self.clear()
+        self.page_px_per_mm = px_per_mm(image)
+        pixmap = QPixmap.fromImage(image)
+        self.page_item = QGraphicsPixmapItem(pixmap)
+        self.page_item.setTransformationMode(Qt.SmoothTransformation)
+        self.page_item.setScale(1 / self.page_px_per_mm)
+        self.page_item.setZValue(-1)
+        self.page_item.setCacheMode(QGraphicsItem.DeviceCoordinateCache)
+        self.scene().addItem(self.page_item)
+        self.scene().setSceneRect(self.page_item.sceneBoundingRect())
+        self.levels = [pixmap]
+        self.level_index = 0
+        self.apply_zoom()
+
+    def set_levels(self, images):
+        """Добавляет построенные в фоне уровни пирамиды текущей страницы"""
+        if self.page_item is None:
+            return
+        preview = self.levels[self.level_index]
+        self.levels = sorted([preview] + [image for image in images if image.width() != preview.width()],
+                             key=lambda level: level.width())
+        self.level_index = self.levels.index(preview)
+        self.update_page_level()
+
+    def update_page_level(self):
+        """Переключает страницу на самый мелкий уровень, которого хватает для масштаба"""
+        if self.page_item is None:
+            return
+        needed = self.zoom * self.levels[0].width() * self.devicePixelRatioF()
+        index = next((i for i, level in enumerate(self.levels) if level.width() >= needed), len(self.levels) - 1)
+        if index == self.level_index:
+            return
 
-    def mousePressEvent(self, event):
-        if event.button() == Qt.LeftButton:
-            self.drag_start_position = event.pos()
-            #self.setCursor(Qt.ClosedHandCursor)
-        self.clicked.emit()
-        super().mousePressEvent(event)
+        level = self.levels[index]
+        if isinstance(level, QImage):
+            # В QPixmap переводим только понадобившиеся уровни и только один раз
+            with perf_log.stage("pyramid_level", **image_info(level)):
+                level = QPixmap.fromImage(level)
+            self.levels[index] = level
+        self.level_index = index
+        self.page_item.setPixmap(level)
+        self.page_item.setScale(self.page_rect().width() / level.width())
+
+    def max_zoom(self):
+        # Крупные сканы можно рассматривать вплоть до двух экранных пикселей на пиксель страницы
+        largest = self.levels[-1].width() if self.levels else 0
+        return max(self.MAX_ZOOM, 2 * largest / self.levels[0].width()) if largest else self.MAX_ZOOM
 
-    def mouseMoveEvent(self, event):
-        if not (event.buttons() & Qt.LeftButton):
+    def clear(self):
+        self.scene().clear()
+        self.page_item = None
+        self.levels = []
+        self.level_index = -1
+        self.elements = []
+
+    def page_rect(self) -> QRectF:
+        return self.scene().sceneRect()
+
+    def add_element(self, placement, image, base_size_mm) -> "DocumentStampItem":
+        """Показывает элемент; image — копия для превью, base_size_mm — размер на листе при scale = 1"""
+        item = DocumentStampItem(placement, QPixmap.fromImage(image), base_size_mm)
+        self.scene().addItem(item)
+        item.setPos(placement.x_mm, placement.y_mm)
+        self.elements.append(item)
+        return item
+
+    def visible_center(self) -> QPointF:
+        """Центр видимой части страницы в мм"""
+        return self.mapToScene(self.viewport().rect().center())
+
+    def element_item(self, placement):
+        return next((item for item in self.elements if item.placement is placement), None)
+
+    def transform_element(self, placement, image=None, base_size_mm=None):
+        """Обновляет элемент после изменения Placement; image — новая копия для превью,
+        base_size_mm — новый размер на листе при scale = 1"""
+        item = self.element_item(placement)
+        if item is None:
             return
-        if self.drag_start_position is None:
+        if base_size_mm is not None:
+            item.base_size_mm = base_size_mm
+        if image is not None:
+            item.setPixmap(QPixmap.fromImage(image))
+        item.update_geometry()
+        item.setPos(placement.x_mm, placement.y_mm)
+
+    def remove_element(self, placement):
+        item = self.element_item(placement)
+        if item is not None:
+            self.scene().removeItem(item)
+            self.elements.remove(item)
+
+    def set_zoom(self, zoom):
+        self.zoom = max(self.MIN_ZOOM, min(zoom, self.max_zoom()))
+        self.apply_zoom()
+
+    def apply_zoom(self):
+        # При масштабе 1 пиксель превью совпадает с пикселем экрана
+        scale = self.zoom * self.page_px_per_mm
+        self.setTransform(QTransform.fromScale(scale, scale))
+        self.update_page_level()
+
+    def wheelEvent(self, event):
+        if event.modifiers() & Qt.ControlModifier:
+            self.set_zoom(self.zoom * (1.25 if event.angleDelta().y() > 0 else 0.8))
             return
+        super().wheelEvent(event)
 
-        # Вычисляем смещение
-        delta = event.pos() - self.drag_start_position
-        new_pos = self.pos() + delta
+    def mousePressEvent(self, event):
+        # Перетаскивать можно сразу несколько выделенных элементов — запоминаем все;
+        # изменение размера ручкой сдвигает элемент, но сообщается отдельно
+        if isinstance(self.itemAt(event.pos()), ElementHandle):
+            self._drag_start = {}
+        else:
+            self._drag_start = {item: item.pos() for item in self.elements}
+        super().mousePressEvent(event)
+
+    def mouseReleaseEvent(self, event):
+        super().mouseReleaseEvent(event)
+        moved = [(item.placement, (start.x(), start.y()))
+                 for item, start in self._drag_start.items() if item.scene() is not None and item.pos() != start]
+        self._drag_start = {}
+        if moved:
+            self.elements_dropped.emit(moved)
+
+    def keyPressEvent(self, event):
+        if event.key() in (Qt.Key_Delete, Qt.Key_Backspace) and not event.modifiers():
+            selected = [item.placement for item in self.elements if item.isSelected()]
+            if selected:
+                self.delete_requested.emit(selected)
+                return
+        if event.modifiers() & Qt.ControlModifier:
+            if event.key() in (Qt.Key_Plus, Qt.Key_Equal):
+                self.set_zoom(self.zoom * 1.25)
+                return
+            if event.key() == Qt.Key_Minus:
+                self.set_zoom(self.zoom * 0.8)
+                return
+            if event.key() == Qt.Key_0:
+                self.set_zoom(1.0)
+                return
+        super().keyPressEvent(event)
+
+
+class DocumentStampItem(QGraphicsPixmapItem):
+    """Печать или подпись на странице; перетаскивается мышью в пределах листа.
+
+    Положение, размер и поворот хранит Placement, элемент их только
+    показывает: изменения сообщаются через сигналы DocumentView. У
+    выделенного элемента есть ручки размера и поворота. Пока ручку тянут,
+    копия для превью растягивается быстрой фильтрацией; после отпускания
+    контроллер заменяет ее сглаженной копией нового размера.
+    """
+
+    MIN_SCALE = 0.2
+    MAX_SCALE = 5.0
+
+    def __init__(self, placement, pixmap, base_size_mm, parent=None):
+        super().__init__(pixmap, parent)
+        self.placement = placement
+        self.base_size_mm = base_size_mm  # Размер на листе при scale = 1
+        self.setTransformationMode(Qt.SmoothTransformation)
+        self.setFlags(QGraphicsItem.ItemIsMovable | QGraphicsItem.ItemIsSelectable
+                      | QGraphicsItem.ItemSendsGeometryChanges)
+        self.setCacheMode(QGraphicsItem.DeviceCoordinateCache)
+        self.setCursor(Qt.OpenHandCursor)
+        self.handles = [ElementHandle(ElementHandle.RESIZE, self), ElementHandle(ElementHandle.ROTATE, self)]
+        self.update_geometry()
+
+    @property
+    def size_mm(self) -> QSizeF:
+        return self.base_size_mm * self.placement.scale
+
+    def center(self) -> QPointF:
+        """Центр элемента в мм листа (поворот и размер меняются вокруг него)"""
+        size = self.size_mm
+        return self.pos() + QPointF(size.width() / 2, size.height() / 2)
+
+    def update_geometry(self):
+        # Копия для превью растягивается ровно до размера на листе и поворачивается вокруг центра
+        pixmap = self.pixmap()
+        size = self.size_mm
+        transform = QTransform()
+        transform.translate(size.width() / 2, size.height() / 2)
+        transform.rotate(self.placement.rotation)
+        transform.translate(-size.width() / 2, -size.height() / 2)
+        transform.scale(size.width() / pixmap.width(), size.height() / pixmap.height())
+        self.setTransform(transform)
+        self.handles[0].setPos(pixmap.width(), pixmap.height())
+        self.handles[1].setPos(pixmap.width(), 0)
+
+    def set_interactive(self, interactive):
+        # Во время перетаскивания ручки кэш перерисовывается на каждый шаг — без сглаживания
+        self.setTransformationMode(Qt.FastTransformation if interactive else Qt.SmoothTransformation)
+
+    def itemChange(self, change, value):
+        if change == QGraphicsItem.ItemPositionChange and self.scene() is not None:
+            # Ограничиваем перемещение границами листа
+            page = self.scene().sceneRect()
+            value.setX(max(page.left(), min(value.x(), page.right() - self.size_mm.width())))
+            value.setY(max(page.top(), min(value.y(), page.bottom() - self.size_mm.height())))
+            return value
+        if change == QGraphicsItem.ItemPositionHasChanged and self.scene() is not None:
+            for view in self.scene().views():
+                view.element_moved.emit(self.placement, value.x(), value.y())
+        if change == QGraphicsItem.ItemSelectedHasChanged:
+            for handle in self.handles:
+                handle.setVisible(bool(value))
+        return super().itemChange(change, value)
+
+    def pixmap_rect(self) -> QRectF:
+        return QRectF(self.offset(), QSizeF(self.pixmap().size()))
+
+    def paint(self, painter, option, widget=None):
+        rect = self.pixmap_rect()
+        painter.fillRect(rect, QColor(255, 255, 255, 150))
+        super().paint(painter, option, widget)
+        pen = QPen(QColor("#888888"), 0, Qt.DashLine)  # Толщина 0 — один пиксель экрана при любом масштабе
+        painter.setPen(pen)
+        painter.drawRect(rect)
+
+
+class ElementHandle(QGraphicsItem):
+    """Ручка размера (квадрат в правом нижнем углу) или поворота (круг в правом верхнем).
+
+    Размер ручки постоянный в пикселях экрана при любом масштабе и размере
+    элемента. Размер меняется пропорционально, поворот — вокруг центра
+    элемента; с Shift поворот идет шагами по 15°.
+    """
+
+    RESIZE = "resize"
+    ROTATE = "rotate"
+    SIZE = 10
+    ROTATION_STEP = 15
+
+    def __init__(self, kind, parent):
+        super().__init__(parent)
+        self.kind = kind
+        self.setFlag(QGraphicsItem.ItemIgnoresTransformations)
+        self.setCursor(Qt.SizeFDiagCursor if kind == self.RESIZE else Qt.CrossCursor)
+        self.setVisible(False)
+        self._start = None
+
+    def boundingRect(self) -> QRectF:
+        return QRectF(-self.SIZE / 2, -self.SIZE / 2, self.SIZE, self.SIZE)
+
+    def paint(self, painter, option, widget=None):
+        painter.setPen(QPen(QColor("#1976d2"), 0))
+        painter.setBrush(QColor("#ffffff"))
+        if self.kind == self.RESIZE:
+            painter.drawRect(self.boundingRect())
+        else:
+            painter.drawEllipse(self.boundingRect())
 
-        # Ограничиваем перемещение границами родителя
-        parent_rect = self.parent().rect()
-        new_pos.setX(max(0, min(new_pos.x(), parent_rect.width() - self.width())))
-        new_pos.setY(max(0, min(new_pos.y(), parent_rect.height() - self.height())))
+    def mousePressEvent(self, event):
+        item = self.parentItem()
+        placement = item.placement
+        center = item.center()
+        offset = event.scenePos() - center
+        self._start = {
+            "geometry": (placement.x_mm, placement.y_mm, placement.scale, placement.rotation),
+            "center": center,
+            "distance": max(math.hypot(offset.x(), offset.y()), 1e-6),
+            "angle": math.degrees(math.atan2(offset.y(), offset.x())),
+        }
+        item.set_interactive(True)
+        event.accept()
 
-        self.move(new_pos)
+    def mouseMoveEvent(self, event):
+        if self._start is None:
+            return
+        item = self.parentItem()
+        _, _, scale, rotation = self._start["geometry"]
+        center = self._start["center"]
+        offset = event.scenePos() - center
+        if self.kind == self.RESIZE:
+            scale *= math.hypot(offset.x(), offset.y()) / self._start["distance"]
+            scale = max(item.MIN_SCALE, min(scale, item.MAX_SCALE))
+        else:
+            rotation += math.degrees(math.atan2(offset.y(), offset.x())) - self._start["angle"]
+            if event.modifiers() & Qt.ShiftModifier:
+                rotation = round(rotation / self.ROTATION_STEP) * self.ROTATION_STEP
+            rotation = (rotation + 180) % 360 - 180
+
+        size = item.base_size_mm * scale
+        x_mm, y_mm = center.x() - size.width() / 2, center.y() - size.height() / 2
+        for view in item.scene().views():
+            view.element_transformed.emit(item.placement, x_mm, y_mm, scale, rotation)
 
     def mouseReleaseEvent(self, event):
-        if event.button() == Qt.LeftButton:
-            self.drag_start_position = None
-            #self.setCursor(Qt.OpenHandCursor)
-        super().mouseReleaseEvent(event)
\ No newline at end of file
+        if self._start is None:
+            return
+        item = self.parentItem()
+        old_geometry = self._start["geometry"]
+        self._start = None
+        item.set_interactive(False)
+        placement = item.placement
+        if old_geometry != (placement.x_mm, placement.y_mm, placement.scale, placement.rotation):
+            for view in item.scene().views():
+                view.element_transform_finished.emit(placement, old_geometry)
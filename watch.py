@@ -0,0 +1,307 @@
+import json
+import os
+import signal
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import CancelledError, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+from pathlib import Path
+
+from PyQt5.QtCore import QCoreApplication, QFileSystemWatcher, QObject, QTimer, pyqtSignal
+
+from batch import _init_pool_worker, _sign_one, add_encoder_arguments, collect_inputs, encoder_from_args, load_template
+from config import DEFAULT_CACHE_DIR, append_json_lines, atomic_write_text, read_json_lines
+from documents import signed_suffix
+from engine import signed_output_path
+
+# Файл берется в работу, только если он не менялся столько секунд (копирование закончено)
+SETTLE_SECONDS = 1.0
+# Пауза после события каталога: пачка новых файлов обрабатывается одним проходом
+SCAN_DELAY_MS = 200
+JOURNAL_NAME = ".journal.jsonl"
+# Сколько раз документ подписывается заново, если исполнитель падает на нем
+MAX_ATTEMPTS = 3
+
+
+def fingerprint(path) -> list:
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class SigningJournal:
+    """Журнал обработанных файлов папки входящих в формате JSON-lines.
+
+    Запись делается после того, как подписанная копия переименована в
+    папку исходящих, поэтому после перезапуска повторно обрабатывается
+    только файл, прерванный на середине. Файл с тем же размером и временем
+    изменения больше не берется, даже если подписать его не удалось;
+    замененный файл подписывается заново.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.entries = {}
+        self.outputs = {}  # Путь подписанной копии -> исходник
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        records = read_json_lines(self.path)
+        for record in records:
+            self.entries[record["file"]] = record
+            if record.get("output"):
+                self.outputs[record["output"]] = record["file"]
+
+        # Повторные записи о замененных файлах копятся; сжимаем журнал до последних
+        if len(records) > 2 * len(self.entries) + 1000:
+            atomic_write_text(self.path, "".join(
+                json.dumps(record, ensure_ascii=False) + "\n" for record in self.entries.values()))
+
+    def is_done(self, name, file_fingerprint) -> bool:
+        record = self.entries.get(name)
+        return record is not None and record["fingerprint"] == file_fingerprint
+
+    def record(self, name, file_fingerprint, ok, output=None, elapsed=0.0) -> None:
+        record = {
+            "file": name,
+            "fingerprint": file_fingerprint,
+            "status": "done" if ok else "failed",
+            "output": output,
+            "ms": round(elapsed * 1000, 1),
+            "ts": round(time.time(), 3),
+        }
+        with self._lock:
+            append_json_lines(self.path, [record], sync=True)
+            self.entries[name] = record
+            if output:
+                self.outputs[output] = name
+
+
+class WatchSignals(QObject):
+    # Сигнал из потока пула процессов доставляется в поток цикла событий
+    done = pyqtSignal(object)
+
+
+class WatchDaemon:
+    """Подписывает документы, появляющиеся в папке входящих.
+
+    QFileSystemWatcher (inotify в Linux) сообщает об изменении каталога,
+    после чего каталог просматривается целиком: так же находятся и файлы,
+    пришедшие, пока служба не работала. Готовые к подписанию файлы ждут в
+    очереди; подписание идет в пуле процессов пакетного режима, в работе
+    не больше workers + queue_size документов.
+
+    Документ, потерянный из-за падения исполнителя или остановки службы, в
+    журнал не попадает: пул пересоздается, а документ подписывается снова
+    (после MAX_ATTEMPTS падений он записывается как ошибка).
+    """
+
+    def __init__(self, inbox, outbox, placements, cache_dir, encoder, workers=1, queue_size=None, journal_path=None):
+        self.inbox = Path(inbox)
+        self.outbox = Path(outbox)
+        self.placements = placements
+        self.cache_dir = cache_dir
+        self.encoder = encoder
+        self.workers = max(1, workers)
+        self.max_in_flight = self.workers + (self.workers if queue_size is None else queue_size)
+        self.journal = SigningJournal(journal_path or self.outbox / JOURNAL_NAME)
+        self.pending = {}  # Future -> (исходник, отпечаток, временный путь, итоговый путь, пул)
+        self.in_flight = set()
+        self.ready = deque()  # (исходник, отпечаток) ждут свободного исполнителя
+        self.attempts = {}
+        self.signed = 0
+        self.failed = 0
+        self.stopping = False
+        self.pool = None
+        self.signals = WatchSignals()
+        self.signals.done.connect(self.on_signed)
+        self.scan_timer = QTimer()
+        self.scan_timer.setSingleShot(True)
+        self.scan_timer.timeout.connect(self.scan)
+
+    def start(self):
+        self.outbox.mkdir(parents=True, exist_ok=True)
+        self.pool = self.create_pool()
+        self.watcher = QFileSystemWatcher([str(self.inbox)])
+        self.watcher.directoryChanged.connect(lambda _: self.schedule_scan(SCAN_DELAY_MS))
+        self.scan()
+
+    def create_pool(self) -> ProcessPoolExecutor:
+        init_args = ((signal.SIGINT, signal.SIGTERM), str(self.cache_dir),
+                     [placement.to_dict() for placement in self.placements], self.encoder.to_dict())
+        # spawn: исполнители не наследуют состояние Qt родительского процесса
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=get_context("spawn"),
+                                   initializer=_init_pool_worker, initargs=init_args)
+
+    def restart_pool(self, broken_pool):
+        # Пересоздаем пул один раз, сколько бы документов ни потерялось вместе с ним
+        if broken_pool is self.pool and not self.stopping:
+            print("Исполнитель завершился аварийно, пул перезапущен", file=sys.stderr)
+            broken_pool.shutdown(wait=False)
+            self.pool = self.create_pool()
+
+    def schedule_scan(self, delay_ms):
+        # Более ранний запланированный просмотр не откладываем
+        if not self.scan_timer.isActive() or self.scan_timer.remainingTime() > delay_ms:
+            self.scan_timer.start(int(delay_ms))
+
+    def scan(self):
+        now = time.time()
+        next_check = None
+        queued = {path.name for path, _ in self.ready}
+        for path in collect_inputs(self.inbox):
+            if path.name in self.in_flight or path.name in queued:
+                continue
+            try:
+                file_fingerprint = fingerprint(path)
+            except OSError:
+                continue  # Файл успели удалить
+            if self.journal.is_done(path.name, file_fingerprint):
+                continue
+
+            age = now - file_fingerprint[1] / 1e9
+            if age < SETTLE_SECONDS:
+                # Файл еще копируется: заглянем, когда он должен успокоиться
+                wait_ms = (SETTLE_SECONDS - age) * 1000 + SCAN_DELAY_MS
+                next_check = wait_ms if next_check is None else min(next_check, wait_ms)
+                continue
+
+            self.ready.append((path, file_fingerprint))
+
+        if next_check is not None:
+            self.schedule_scan(next_check)
+        self.submit_ready()
+
+    def submit_ready(self):
+        # Каталог заново не просматривается: проверяется только сам файл из очереди
+        while self.ready and len(self.pending) < self.max_in_flight:
+            path, file_fingerprint = self.ready.popleft()
+            try:
+                current = fingerprint(path)
+            except OSError:
+                continue  # Файл успели удалить
+            if current != file_fingerprint:
+                self.schedule_scan(SETTLE_SECONDS * 1000 + SCAN_DELAY_MS)  # Файл снова меняется
+                continue
+            self.submit(path, file_fingerprint)
+
+    def output_owner(self, save_path):
+        for source, _, _, pending_path, _ in self.pending.values():
+            if pending_path == save_path:
+                return source.name
+        return self.journal.outputs.get(str(save_path))
+
+    def submit(self, path, file_fingerprint):
+        suffix = signed_suffix(path, self.encoder)
+        save_path = signed_output_path(path, self.outbox, suffix)
+        if self.output_owner(save_path) not in (None, path.name):
+            # При смене формата a.png и a.bmp дали бы одну копию: оставляем расширение исходника
+            save_path = signed_output_path(path, self.outbox, suffix, keep_suffix=True)
+        # Пишем под временным именем: в исходящих не появляются недописанные файлы
+        temp_path = save_path.with_name(f".{save_path.name}")
+        args = (_sign_one, str(path), str(temp_path), str(save_path))
+        try:
+            future = self.pool.submit(*args)
+        except BrokenProcessPool:
+            self.restart_pool(self.pool)
+            future = self.pool.submit(*args)
+        self.pending[future] = (path, file_fingerprint, temp_path, save_path, self.pool)
+        self.in_flight.add(path.name)
+        future.add_done_callback(self.signals.done.emit)
+
+    def on_signed(self, future):
+        if future not in self.pending:
+            return
+        path, file_fingerprint, temp_path, save_path, pool = self.pending.pop(future)
+        self.in_flight.discard(path.name)
+        try:
+            ok, elapsed, _ = future.result()
+        except (BrokenProcessPool, CancelledError, KeyboardInterrupt):
+            # Документ потерян вместе с исполнителем, а не из-за ошибки в нем
+            Path(temp_path).unlink(missing_ok=True)
+            self.restart_pool(pool)
+            self.attempts[path.name] = self.attempts.get(path.name, 0) + 1
+            if self.stopping:
+                print(f"{path}: прерван, будет подписан при следующем запуске", file=sys.stderr)
+                return
+            if self.attempts[path.name] < MAX_ATTEMPTS:
+                self.ready.append((path, file_fingerprint))
+                self.submit_ready()
+                return
+            ok, elapsed = False, 0.0
+        except Exception as e:
+            print(f"{path}: {e}", file=sys.stderr)
+            ok, elapsed = False, 0.0
+
+        if ok:
+            os.replace(temp_path, save_path)
+            self.signed += 1
+            print(f"{path} -> {save_path} ({elapsed * 1000:.0f} мс)")
+        else:
+            Path(temp_path).unlink(missing_ok=True)
+            self.failed += 1
+            print(f"{path}: ошибка подписания ({elapsed * 1000:.0f} мс)", file=sys.stderr)
+        self.attempts.pop(path.name, None)
+        self.journal.record(path.name, file_fingerprint, ok, str(save_path) if ok else None, elapsed)
+        if not self.stopping:
+            self.submit_ready()
+
+    def stop(self):
+        """Дожидается документов в работе и записывает их в журнал"""
+        if self.pool is None:
+            return
+        self.stopping = True
+        self.scan_timer.stop()
+        wait(list(self.pending))
+        for future in list(self.pending):
+            self.on_signed(future)
+        self.pool.shutdown()
+        self.pool = None
+
+
+def run_watch(inbox, outbox, template, cache_dir=DEFAULT_CACHE_DIR, workers=1, queue_size=None, encoder=None,
+              journal_path=None) -> int:
+    if not Path(inbox).is_dir():
+        print(f"Нет каталога входящих: {inbox}", file=sys.stderr)
+        return 1
+    try:
+        placements = load_template(template, cache_dir)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    app = QCoreApplication.instance() or QCoreApplication(sys.argv[:1])
+    daemon = WatchDaemon(inbox, outbox, placements, cache_dir, encoder, workers, queue_size, journal_path)
+
+    # Ctrl+C и SIGTERM завершают цикл событий; таймер дает Python обработать сигнал
+    signal.signal(signal.SIGINT, lambda *_: app.quit())
+    signal.signal(signal.SIGTERM, lambda *_: app.quit())
+    signal_timer = QTimer()
+    signal_timer.timeout.connect(lambda: None)
+    signal_timer.start(500)
+
+    daemon.start()
+    print(f"Слежу за {inbox}, подписанные копии — в {outbox}")
+    app.exec_()
+    daemon.stop()
+    print(f"Подписано {daemon.signed}, ошибок {daemon.failed}")
+    return 0
+
+
+def add_arguments(parser):
+    parser.add_argument("inbox", help="Каталог входящих документов")
+    parser.add_argument("outbox", help="Каталог для подписанных копий")
+    parser.add_argument("-t", "--template", required=True, help="Имя сохраненного шаблона размещения или JSON-файл")
+    parser.add_argument("--cache-dir", default=str(DEFAULT_CACHE_DIR), help="Каталог с библиотекой печатей, шаблонами и settings.json")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count() or 1, help="Число процессов-исполнителей")
+    parser.add_argument("--queue-size", type=int, help="Сколько документов может ждать свободного исполнителя (по умолчанию = --workers)")
+    parser.add_argument("--journal", help=f"Журнал обработанных файлов (по умолчанию {JOURNAL_NAME} в каталоге исходящих)")
+    add_encoder_arguments(parser)
+
+
+def run_from_args(args) -> int:
+    return run_watch(args.inbox, args.outbox, args.template, args.cache_dir, args.workers, args.queue_size,
+                     encoder_from_args(args), args.journal)